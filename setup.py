@@ -18,7 +18,8 @@ setup(
     py_modules=[os.path.splitext(os.path.basename(path))[0] for path in glob('src/*.py')],
     include_packagge_data=True,
     zip_safe=False,
-    scripts=['scripts/copy-and-stitch', 'scripts/stitch'],
+    scripts=['scripts/copy-and-stitch', 'scripts/stitch', 'scripts/flugelhorn-daemon',
+             'scripts/flugelhorn-server', 'scripts/thumbnails'],
     classifiers=[
         'Operating System :: Unix',
         'Operating System :: POSIX',
@@ -28,6 +29,7 @@ setup(
     install_requires=[
         'absl-py',
 	'ruamel.yaml',
-	'imageio'
+	'imageio',
+	'numpy'
     ]
 )
@@ -0,0 +1,167 @@
+"""Disk space admission control for copy and stitch jobs.
+
+Before a job writes to a drive, it reserves its expected footprint. A job
+is admitted if the drive's free space, less a safety headroom and less the
+outstanding reservations of other running jobs, covers its footprint.
+Otherwise it is deferred until other jobs finish, or rejected with an
+InsufficientSpaceError if it could never fit. A deferred job can be
+cancelled with a cancel event.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+import os
+import shutil
+import threading
+
+
+# Free space always left on a drive, in bytes
+DEFAULT_HEADROOM = 2**30
+
+
+class InsufficientSpaceError(Exception):
+    """Raised when a job can't fit on its destination drive."""
+
+
+class AdmissionCancelled(Exception):
+    """Raised when a job is cancelled while it is deferred."""
+
+
+class Reservation:
+    """Space reserved on a drive for a single job.
+
+    The outstanding amount shrinks as the job writes data, either reported
+    with consume() or measured from the size of watched output files,
+    since written data is already counted by the drive's free space.
+    """
+    def __init__(self, device, nbytes, label, watch_paths=()):
+        self.device = device
+        self.nbytes = nbytes
+        self.label = label
+        self.watch_paths = list(watch_paths)
+        self.consumed = 0
+
+
+    def consume(self, nbytes):
+        """Record bytes written by the job."""
+        self.consumed += nbytes
+
+
+    def outstanding(self):
+        """Return the reserved bytes not yet written."""
+        written = self.consumed
+        for path in self.watch_paths:
+            try:
+                written += os.path.getsize(path)
+            except OSError:
+                pass
+        return max(0, self.nbytes - written)
+
+
+class DiskBudget:
+    """Track space reservations of concurrent jobs across drives.
+
+    A single DiskBudget should be shared by all workers writing to the
+    same drives.
+
+    Args:
+        headroom: bytes of free space to always leave on a drive
+        poll_interval: seconds between free space checks while deferred
+        disk_usage: function returning shutil.disk_usage for a path
+    """
+    def __init__(self, headroom=DEFAULT_HEADROOM, poll_interval=5,
+                 disk_usage=shutil.disk_usage):
+        self.headroom = headroom
+        self.poll_interval = poll_interval
+        self._disk_usage = disk_usage
+        self._reservations = []
+        self._condition = threading.Condition()
+
+
+    def available(self, path):
+        """Return the unreserved free bytes on the drive containing path."""
+        device = os.stat(path).st_dev
+        with self._condition:
+            return self._available(path, device)
+
+
+    def acquire(self, path, nbytes, label, watch_paths=(), cancel_event=None):
+        """Reserve space on the drive containing path, waiting if necessary.
+
+        Args:
+            path: an existing path on the destination drive
+            nbytes: expected bytes to be written
+            label: job description for messages
+            watch_paths: optional output files, whose sizes count as written
+            cancel_event: optional threading.Event. If it is set while the
+                          job is deferred, the job stops waiting, within
+                          poll_interval seconds.
+        Returns:
+            Reservation, to be passed to release() when the job is done
+        Raises:
+            InsufficientSpaceError: if the job doesn't fit, and there are no
+                other reservations on the drive that could free up space
+            AdmissionCancelled: if cancel_event is set while deferred
+        """
+        device = os.stat(path).st_dev
+        deferred = False
+        with self._condition:
+            while True:
+                available = self._available(path, device)
+                if nbytes <= available:
+                    break
+                others = [r for r in self._reservations if r.device == device]
+                if not others:
+                    raise InsufficientSpaceError(
+                        'Not enough space for {0} on {1}: needs {2}, {3} available '
+                        '(keeping {4} free).'.format(label, path, format_bytes(nbytes),
+                                                     format_bytes(max(0, available)),
+                                                     format_bytes(self.headroom)))
+                if cancel_event is not None and cancel_event.is_set():
+                    print('Cancelled {0} while deferred.'.format(label))
+                    raise AdmissionCancelled(label)
+                if not deferred:
+                    print('Deferring {0}: needs {1}, {2} available on {3} until {4} '
+                          'other jobs finish.'.format(label, format_bytes(nbytes),
+                                                      format_bytes(max(0, available)),
+                                                      path, len(others)))
+                    deferred = True
+                self._condition.wait(self.poll_interval)
+
+            reservation = Reservation(device, nbytes, label, watch_paths)
+            self._reservations.append(reservation)
+        if deferred:
+            print('Admitted {0}.'.format(label))
+
+        return reservation
+
+
+    def release(self, reservation):
+        """Release a reservation, and wake any deferred jobs."""
+        with self._condition:
+            if reservation in self._reservations:
+                self._reservations.remove(reservation)
+            self._condition.notify_all()
+
+
+    @contextlib.contextmanager
+    def reserve(self, path, nbytes, label, watch_paths=(), cancel_event=None):
+        """Context manager holding a reservation while a job runs."""
+        reservation = self.acquire(path, nbytes, label, watch_paths, cancel_event)
+        try:
+            yield reservation
+        finally:
+            self.release(reservation)
+
+
+    def _available(self, path, device):
+        reserved = sum(r.outstanding() for r in self._reservations if r.device == device)
+        return self._disk_usage(path).free - self.headroom - reserved
+
+
+def format_bytes(nbytes):
+    """Format a byte count for messages, e.g. '12.3 GB'."""
+    return '{0:.1f} GB'.format(nbytes / 1e9)
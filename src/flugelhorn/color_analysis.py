@@ -0,0 +1,154 @@
+"""Exposure and color analysis of raw lens videos.
+
+A few keyframes are sampled from every lens, and luminance and chroma
+statistics are accumulated over all of them. Only one small frame is held
+in memory at a time, and the accumulators have a fixed size, so memory
+use doesn't depend on the number of frames analyzed.
+
+The statistics are mapped to starting values for the stitcher's color
+settings with simple heuristics. They correct obvious under/over exposure
+and color casts, and are not a substitute for grading.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import namedtuple
+
+import numpy as np
+
+from flugelhorn.video_utils import NUM_LENSES, KeyframeError, extract_keyframe, sample_times
+
+
+# Rec. 709 luma weights
+LUMA_WEIGHTS = np.array([0.2126, 0.7152, 0.0722])
+
+# Color settings are clamped to the stitcher's slider range
+COLOR_RANGE = (-100, 100)
+
+# Targets for a well exposed, neutral scene (luma and saturation in 0-1)
+TARGET_LUMA = 0.45
+TARGET_SPREAD = 0.8
+TARGET_SATURATION = 0.3
+HIGHLIGHT_CLIP = 0.92
+SHADOW_CLIP = 0.05
+
+# Color settings that analysis fills in
+AUTO_COLOR_SETTINGS = ('brightness', 'contrast', 'highlight', 'shadow',
+                       'saturation', 'tempture', 'tint')
+
+# Summary statistics of the analyzed frames, all in the range 0-1
+# mean_luma: mean Rec. 709 luma
+# low_luma, high_luma: 2nd and 98th percentile luma
+# mean_rgb: mean (r, g, b)
+# mean_saturation: mean HSV saturation
+ExposureStats = namedtuple('ExposureStats',
+                           'mean_luma low_luma high_luma mean_rgb mean_saturation')
+
+
+class ExposureAccumulator:
+    """Accumulate exposure statistics one frame at a time."""
+    def __init__(self, bins=256):
+        self.bins = bins
+        self.histogram = np.zeros(bins, np.int64)
+        self.rgb_sum = np.zeros(3)
+        self.saturation_sum = 0.0
+        self.pixels = 0
+
+
+    def add(self, frame):
+        """Add a uint8 RGB frame of shape (height, width, 3)."""
+        rgb = frame.reshape(-1, 3).astype(np.float32) / 255
+        luma = rgb @ LUMA_WEIGHTS.astype(np.float32)
+        bins = np.minimum((luma * self.bins).astype(np.int64), self.bins - 1)
+        self.histogram += np.bincount(bins, minlength=self.bins)
+
+        max_rgb = rgb.max(axis=1)
+        chroma = max_rgb - rgb.min(axis=1)
+        saturation = np.divide(chroma, max_rgb, out=np.zeros_like(chroma),
+                               where=max_rgb > 0)
+        self.rgb_sum += rgb.sum(axis=0, dtype=np.float64)
+        self.saturation_sum += float(saturation.sum(dtype=np.float64))
+        self.pixels += rgb.shape[0]
+
+
+    def stats(self):
+        """Return ExposureStats for all frames added so far."""
+        if not self.pixels:
+            raise ValueError('No frames have been analyzed.')
+        centers = (np.arange(self.bins) + 0.5) / self.bins
+        cumulative = np.cumsum(self.histogram) / self.pixels
+        low = centers[np.searchsorted(cumulative, 0.02)]
+        high = centers[np.searchsorted(cumulative, 0.98)]
+        mean_luma = float(self.histogram @ centers) / self.pixels
+
+        return ExposureStats(mean_luma, float(low), float(high),
+                             tuple(float(c) for c in self.rgb_sum / self.pixels),
+                             self.saturation_sum / self.pixels)
+
+
+def analyze_stitch_source(stitch_source, num_frames=3, width=256):
+    """Measure exposure statistics over keyframes of every lens.
+
+    Args:
+        stitch_source: StitchSource for a raw video directory
+        num_frames: number of moments sampled from each lens
+        width: width frames are scaled down to for analysis
+    Returns:
+        ExposureStats
+    Raises:
+        KeyframeError: if there are no videos, or a keyframe can't be extracted
+    """
+    if not stitch_source.media:
+        raise KeyframeError('No videos to analyze.')
+    source_width, source_height = stitch_source.media[0]['size']
+    size = (width, 2 * max(1, round(width * source_height / source_width / 2)))
+    accumulator = ExposureAccumulator()
+    for group, timestamp in sample_times(stitch_source.media, num_frames):
+        for lens in range(NUM_LENSES):
+            accumulator.add(extract_keyframe(group[lens], timestamp, size))
+
+    return accumulator.stats()
+
+
+def suggest_color_settings(stats):
+    """Map exposure statistics to suggested color settings.
+
+    Positive tempture warms the image, and positive tint shifts it
+    towards magenta.
+
+    Returns:
+        dict of color setting name -> int
+    """
+    mean_r, mean_g, mean_b = stats.mean_rgb
+    gray = max((mean_r + mean_g + mean_b) / 3, 1e-6)
+    suggestions = {
+        'brightness': (TARGET_LUMA - stats.mean_luma) * 200,
+        'contrast': (TARGET_SPREAD - (stats.high_luma - stats.low_luma)) * 100,
+        'highlight': -max(0.0, stats.high_luma - HIGHLIGHT_CLIP) * 500,
+        'shadow': max(0.0, SHADOW_CLIP - stats.low_luma) * 500,
+        'saturation': (TARGET_SATURATION - stats.mean_saturation) * 100,
+        # Gray world white balance: warm up blue casts, cool down orange ones
+        'tempture': (mean_b - mean_r) / gray * 50,
+        # and pull green casts towards magenta
+        'tint': (mean_g - (mean_r + mean_b) / 2) / gray * 50,
+    }
+    low, high = COLOR_RANGE
+    return {key: int(min(high, max(low, round(value))))
+            for key, value in suggestions.items()}
+
+
+def unset_color_settings(color):
+    """Return the color settings that analysis would fill in.
+
+    Settings left at 0 or unset are treated as not set by the user.
+    """
+    return [key for key in AUTO_COLOR_SETTINGS if not getattr(color, key, None)]
+
+
+def apply_color_suggestions(color, suggestions):
+    """Set suggested values on a color Setting, keeping any user-set values."""
+    for key in unset_color_settings(color):
+        if key in suggestions:
+            setattr(color, key, suggestions[key])
@@ -9,6 +9,9 @@ import os
 
 import imageio
 
+from flugelhorn.color_analysis import (analyze_stitch_source, apply_color_suggestions,
+                                       suggest_color_settings, unset_color_settings)
+from flugelhorn.video_utils import KeyframeError
 from flugelhorn.xml_utils import parse_proj_xml, write_config_xml
 from flugelhorn.yaml_utils import load_configuration_from_yaml
 
@@ -23,7 +26,8 @@ imageio.plugins.ffmpeg.download()
 StitchSource = namedtuple('StitchSource', 'media proj gyro')
 
 
-def create_and_write_stitching_config_from_raw(raw_video_dir, stitched_dir, settings_yaml):
+def create_and_write_stitching_config_from_raw(raw_video_dir, stitched_dir, settings_yaml,
+                                               auto_color=False, hidden_output=False):
     """Create a complete stitching configuration from a raw video directory.
 
     Creates a stitching config and writes to an xml file 
@@ -31,6 +35,9 @@ def create_and_write_stitching_config_from_raw(raw_video_dir, stitched_dir, sett
         raw_video_dir: directory path containing raw video (.mp4) files,
                        pro.prj file, and gyro.dat file
         stitched_dir: directory path to output stitched video (.mp4) file
+        auto_color: fill unset color settings from an analysis of the raw video
+        hidden_output: write the stitched video to a hidden .<name>.mp4 file,
+                       e.g. so it can be finished before it is visible
     Returns:
         xml_path: path to XML used for stitching
                 used for stitching 
@@ -41,7 +48,10 @@ def create_and_write_stitching_config_from_raw(raw_video_dir, stitched_dir, sett
     stitch_source = build_stitching_source(raw_video_dir)
     print(stitch_source)
     config = load_configuration_from_yaml(settings_yaml) 
-    final_config = build_stitching_config(config, stitch_source, stitched_path)
+    stitched_dest = stitched_path
+    if hidden_output:
+        stitched_dest = os.path.join(stitched_dir, '.{0}'.format(base_filename))
+    final_config = build_stitching_config(config, stitch_source, stitched_dest, auto_color)
 
     # Write XML for stitching
     xml_save_path = '{0}.xml'.format(stitched_path)
@@ -77,6 +87,7 @@ def build_stitching_source(path):
         metadata = _get_video_grp_metadata(vid_group[0])
         vid_group['start'] = metadata['start']
         vid_group['end'] = metadata['end']
+        vid_group['size'] = metadata['size']
         # Use the previous group's end time as the offset
         if n == 0:
             vid_group['ptsOffset'] = 0
@@ -92,11 +103,29 @@ def build_stitching_source(path):
     return StitchSource(video_groups, proj, gyro)
 
 
-def build_stitching_config(config, stitch_source, stitched_dest):
+def probe_recording_duration(path):
+    """Return the total duration of a raw video directory in seconds.
+
+    Returns:
+        Duration in seconds, or None if the directory can't be probed
+    """
+    try:
+        stitch_source = build_stitching_source(path)
+    except Exception as e:
+        print('Unable to probe duration of {0}: {1}'.format(path, e))
+        return None
+
+    return sum(group['end'] - group['start'] for group in stitch_source.media)
+
+
+def build_stitching_config(config, stitch_source, stitched_dest, auto_color=False):
     """Build stitching configuration.
 
     Read a starting configuration from a YAML file,
-    and add in specific file names and destinations."""
+    and add in specific file names and destinations.
+    If auto_color is set, color settings left at 0 are replaced with
+    suggestions based on the exposure of the raw video. If the video
+    can't be analyzed, the YAML color settings are kept."""
 
     print(config)
 
@@ -119,15 +148,45 @@ def build_stitching_config(config, stitch_source, stitched_dest):
     config.gyro_calibration.gravity_y = proj_dict['gravity_y']
     config.gyro_calibration.gravity_z = proj_dict['gravity_z']
 
+    if auto_color and not unset_color_settings(config.color):
+        print('All color settings are set, skipping color analysis.')
+    elif auto_color:
+        try:
+            stats = analyze_stitch_source(stitch_source)
+        except KeyframeError as e:
+            print('Warning: color analysis failed, keeping color settings: {0}'.format(e))
+        else:
+            print(stats)
+            apply_color_suggestions(config.color, suggest_color_settings(stats))
+
     return config
 
 
+# Probed video group metadata, keyed by file path, size and modification time.
+_METADATA_CACHE = {}
+
+
 def _get_video_grp_metadata(mp4_file):
-    """Get metadata of a video group based on the first origin.mp4 file."""
+    """Get metadata of a video group based on the first origin.mp4 file.
+
+    Probing is cached per file, and invalidated if the file changes.
+    """
+    stat = os.stat(mp4_file)
+    key = (os.path.abspath(mp4_file), stat.st_size, stat.st_mtime_ns)
+    if key not in _METADATA_CACHE:
+        _METADATA_CACHE[key] = _probe_video_grp_metadata(mp4_file)
+
+    return dict(_METADATA_CACHE[key])
+
+
+def _probe_video_grp_metadata(mp4_file):
+    """Read video group metadata from an mp4 file."""
     reader = imageio.get_reader(mp4_file)
     raw_metadata = reader.get_meta_data()
+    reader.close()
     grp_metadata = {}
     grp_metadata['start'] = 0
     grp_metadata['end'] = round(raw_metadata['nframes'] / raw_metadata['fps'], 3)
+    grp_metadata['size'] = tuple(raw_metadata['size'])
 
     return grp_metadata
@@ -12,7 +12,8 @@ def find_video_image_dirs(path):
     source_video_dirs = []
     source_image_dirs = []
     for entry in os.scandir(path):
-        if entry.is_dir():
+        # Hidden dirs include partial copies, see partial_path()
+        if entry.is_dir() and not entry.name.startswith('.'):
             # todo(ryan): divide by video and images
             # print(entry.path)
             # print(entry.name)
@@ -30,12 +31,47 @@ def copy_source_to_raw_dirs(source_dirs, dest_base):
         folder_name = os.path.split(d)[1]
         dest_path = os.path.join(dest_base, folder_name) 
         print('Copying {0} to {1}.'.format(d, dest_path))
-        shutil.copytree(d, dest_path) 
+        # Copy to a hidden dir first, so dest_path only ever holds a complete copy
+        part_path = partial_path(dest_path)
+        if os.path.exists(part_path):
+            shutil.rmtree(part_path)
+        shutil.copytree(d, part_path)
+        os.rename(part_path, dest_path)
         dest_paths.append(dest_path)
         
     return dest_paths
 
 
+def partial_path(path):
+    """Return the hidden path a file or dir is written to before being moved to path."""
+    dirname, name = os.path.split(path)
+    return os.path.join(dirname, '.{0}.part'.format(name))
+
+
+def dir_snapshot(path):
+    """Return a (file count, total bytes, latest mtime) summary of a directory tree.
+
+    Two equal snapshots taken some time apart indicate that nothing is
+    still being written to the directory.
+    """
+    num_files = 0
+    total_size = 0
+    latest_mtime = 0
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            sub_files, sub_size, sub_mtime = dir_snapshot(entry.path)
+            num_files += sub_files
+            total_size += sub_size
+            latest_mtime = max(latest_mtime, sub_mtime)
+        elif entry.is_file(follow_symlinks=False):
+            stat = entry.stat(follow_symlinks=False)
+            num_files += 1
+            total_size += stat.st_size
+            latest_mtime = max(latest_mtime, stat.st_mtime_ns)
+
+    return num_files, total_size, latest_mtime
+
+
 def check_paths(paths):
     """Check that all supplied paths are directories."""
     for p in paths:
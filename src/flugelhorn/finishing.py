@@ -0,0 +1,443 @@
+"""Post-stitch finishing of stitched videos for upload and streaming.
+
+Finishing never re-encodes. Each stitched video is:
+    1. Remuxed with ffmpeg stream copy, moving the moov box to the front
+       of the file (faststart) so playback can begin before download ends.
+    2. Tagged with Spherical Video (V1) metadata, and Spatial Audio (SA3D)
+       metadata if the audio track is first order ambisonics, by rewriting
+       the moov box in place.
+
+Intermediate files are hidden temp files in the same directory, and the
+finished video atomically replaces the stitched video, so downstream sync
+tools never see a partial file.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import struct
+import subprocess
+import traceback
+
+import imageio
+
+from flugelhorn.admission import InsufficientSpaceError
+from flugelhorn.yaml_utils import load_configuration_from_yaml
+
+
+# Google Spherical Video V1 metadata is stored in a uuid box in the video track
+SPHERICAL_UUID = bytes.fromhex('ffcc8263f8554a938814587a02521fdd')
+SPHERICAL_XML = (
+    '<?xml version="1.0"?>'
+    '<rdf:SphericalVideo xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" '
+    'xmlns:GSpherical="http://ns.google.com/videos/1.0/spherical/">'
+    '<GSpherical:Spherical>true</GSpherical:Spherical>'
+    '<GSpherical:Stitched>true</GSpherical:Stitched>'
+    '<GSpherical:StitchingSoftware>Insta360 ProStitcher</GSpherical:StitchingSoftware>'
+    '<GSpherical:ProjectionType>equirectangular</GSpherical:ProjectionType>'
+    '{0}'
+    '</rdf:SphericalVideo>')
+STEREO_MODE_XML = '<GSpherical:StereoMode>{0}</GSpherical:StereoMode>'
+
+# Spherical metadata stereo modes for each blend.mode setting
+# stereo_top_right and stereo_separate have no V1 equivalent, so they get no
+# spherical video metadata rather than being tagged mono
+STEREO_MODES = {
+    'pano': None,
+    'stereo_top_left': 'top-bottom',
+}
+
+# Boxes which only contain other boxes, on the path to sample tables
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+# Ambisonic audio has 4 channels for first order (ACN channel order, SN3D)
+AMBISONIC_CHANNELS = 4
+
+
+class FinishingError(Exception):
+    """Raised when a stitched video can't be finished."""
+
+
+class Box:
+    """An MP4 box. Container boxes hold child boxes instead of payload bytes.
+
+    Sample entries (e.g. mp4a) hold both: payload is the fixed part of the
+    entry, followed by any children.
+    """
+    def __init__(self, box_type, payload=b'', children=None):
+        self.type = box_type
+        self.payload = payload
+        self.children = children
+
+
+    def find(self, box_type):
+        """Return the first direct child of a type, or None."""
+        for child in self.children or []:
+            if child.type == box_type:
+                return child
+        return None
+
+
+    def to_bytes(self):
+        body = self.payload
+        if self.children is not None:
+            body += b''.join(child.to_bytes() for child in self.children)
+        if len(body) + 8 > 0xffffffff:
+            return struct.pack('>I4sQ', 1, self.type, len(body) + 16) + body
+        return struct.pack('>I4s', len(body) + 8, self.type) + body
+
+
+def finish_stitched_video(video_path, stereo_mode=None, spatial_audio=True, dest_path=None,
+                          spherical_video=True):
+    """Faststart remux a stitched video and inject 360 metadata.
+
+    Args:
+        video_path: path to a stitched video (.mp4) file
+        stereo_mode: spherical metadata stereo mode, e.g. 'top-bottom',
+                     or None for monoscopic video
+        spatial_audio: tag 4 channel audio tracks as ambisonic
+        dest_path: path for the finished video. If given, video_path is
+                   removed once finished. Defaults to finishing in place.
+        spherical_video: inject spherical video metadata
+    Raises:
+        FinishingError: if remuxing fails, or the video can't be parsed
+    """
+    remuxed_path, finished_path = _temp_paths(video_path)
+    try:
+        faststart_remux(video_path, remuxed_path)
+        inject_spherical_metadata(remuxed_path, finished_path, stereo_mode, spatial_audio,
+                                  spherical_video)
+        os.replace(finished_path, dest_path or video_path)
+        if dest_path and os.path.abspath(dest_path) != os.path.abspath(video_path):
+            os.remove(video_path)
+    finally:
+        for path in [remuxed_path, finished_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _temp_paths(video_path):
+    """Return the hidden (remuxed, finished) temp paths used to finish a video."""
+    dirname, filename = os.path.split(video_path)
+    return (os.path.join(dirname, '.{0}.faststart.part'.format(filename)),
+            os.path.join(dirname, '.{0}.part'.format(filename)))
+
+
+def faststart_remux(src, dst):
+    """Copy all streams from src to dst, with the moov box at the front."""
+    ffmpeg = imageio.plugins.ffmpeg.get_exe()
+    result = subprocess.run(
+        [ffmpeg, '-y', '-v', 'error', '-i', src, '-map', '0', '-c', 'copy',
+         '-movflags', '+faststart', '-f', 'mp4', dst],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise FinishingError('ffmpeg remux of {0} failed: {1}'.format(
+            src, result.stderr.decode('utf-8', 'replace').strip()))
+
+
+def inject_spherical_metadata(src, dst, stereo_mode=None, spatial_audio=True,
+                              spherical_video=True):
+    """Copy an MP4 file from src to dst, adding 360 video and audio metadata.
+
+    Spherical video metadata is only added if spherical_video is set, and
+    spatial audio metadata if spatial_audio is set. Only the moov box is
+    rewritten. Chunk offsets are updated if the moov
+    box grows and precedes the media data. Media data is copied unchanged.
+    """
+    with open(src, 'rb') as f:
+        top_level = _read_top_level_boxes(f)
+        moov_entry = next((b for b in top_level if b[0] == b'moov'), None)
+        if moov_entry is None:
+            raise FinishingError('{0} has no moov box.'.format(src))
+        _, moov_offset, moov_size, moov_header = moov_entry
+        f.seek(moov_offset + moov_header)
+        moov = Box(b'moov', children=_parse_boxes(f.read(moov_size - moov_header)))
+
+        if spherical_video:
+            _add_spherical_video(moov, stereo_mode)
+        if spatial_audio:
+            _add_spatial_audio(moov)
+
+        delta = len(moov.to_bytes()) - moov_size
+        if delta and any(b[0] == b'mdat' and b[1] > moov_offset for b in top_level):
+            # Promoting stco boxes grows the moov box again, so repeat until
+            # every shifted offset fits
+            while _promote_chunk_offsets(moov, delta):
+                delta = len(moov.to_bytes()) - moov_size
+            _shift_chunk_offsets(moov, delta)
+        moov_bytes = moov.to_bytes()
+
+        with open(dst, 'wb') as out:
+            for box_type, offset, size, _ in top_level:
+                if box_type == b'moov':
+                    out.write(moov_bytes)
+                else:
+                    _copy_range(f, out, offset, size)
+
+
+def _read_top_level_boxes(f):
+    """Return (type, offset, size, header size) for each top-level box in a file."""
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    boxes = []
+    offset = 0
+    while offset < file_size:
+        f.seek(offset)
+        size, box_type = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header:
+            raise FinishingError('Invalid {0!r} box size at offset {1}.'.format(box_type, offset))
+        boxes.append((box_type, offset, size, header))
+        offset += size
+
+    return boxes
+
+
+def _parse_boxes(data):
+    """Parse a sequence of boxes, recursing into the containers we modify."""
+    boxes = []
+    offset = 0
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = len(data) - offset
+        if size < header or offset + size > len(data):
+            raise FinishingError('Invalid {0!r} box size.'.format(box_type))
+        payload = data[offset + header:offset + size]
+        if box_type in CONTAINER_BOXES:
+            boxes.append(Box(box_type, children=_parse_boxes(payload)))
+        elif box_type == b'stsd':
+            boxes.append(_parse_stsd(payload))
+        else:
+            boxes.append(Box(box_type, payload))
+        offset += size
+
+    return boxes
+
+
+def _parse_stsd(payload):
+    """Parse a sample description box, splitting mp4a entries into children."""
+    entries = []
+    for entry in _parse_boxes(payload[8:]):
+        if entry.type == b'mp4a':
+            fixed_size = _audio_entry_size(entry.payload)
+            entry = Box(b'mp4a', entry.payload[:fixed_size],
+                        _parse_boxes(entry.payload[fixed_size:]))
+        entries.append(entry)
+
+    return Box(b'stsd', payload[:8], entries)
+
+
+def _audio_entry_size(payload):
+    """Size of the fixed fields of an audio sample entry, by version."""
+    version = struct.unpack_from('>H', payload, 8)[0]
+    return {0: 28, 1: 44, 2: 64}.get(version, 28)
+
+
+def _track_handler(trak):
+    """Return the handler type of a track, e.g. b'vide' or b'soun'."""
+    mdia = trak.find(b'mdia')
+    hdlr = mdia.find(b'hdlr') if mdia else None
+    if hdlr is None:
+        return None
+    return hdlr.payload[8:12]
+
+
+def _sample_table(trak):
+    mdia = trak.find(b'mdia')
+    minf = mdia.find(b'minf') if mdia else None
+    return minf.find(b'stbl') if minf else None
+
+
+def _add_spherical_video(moov, stereo_mode):
+    """Add a spherical uuid box to the first video track."""
+    for trak in moov.children:
+        if trak.type != b'trak' or _track_handler(trak) != b'vide':
+            continue
+        if any(child.type == b'uuid' and child.payload[:16] == SPHERICAL_UUID
+               for child in trak.children):
+            return
+        stereo = STEREO_MODE_XML.format(stereo_mode) if stereo_mode else ''
+        xml = SPHERICAL_XML.format(stereo).encode('utf-8')
+        trak.children.append(Box(b'uuid', SPHERICAL_UUID + xml))
+        return
+    raise FinishingError('No video track found.')
+
+
+def _add_spatial_audio(moov):
+    """Add SA3D boxes to 4 channel (first order ambisonic) mp4a tracks."""
+    for trak in moov.children:
+        if trak.type != b'trak' or _track_handler(trak) != b'soun':
+            continue
+        stbl = _sample_table(trak)
+        stsd = stbl.find(b'stsd') if stbl else None
+        for entry in stsd.children if stsd else []:
+            if entry.type != b'mp4a' or entry.find(b'SA3D'):
+                continue
+            channels = struct.unpack_from('>H', entry.payload, 16)[0]
+            if channels != AMBISONIC_CHANNELS:
+                continue
+            # version, periphonic, order 1, ACN ordering, SN3D normalization,
+            # and an identity channel map
+            sa3d = struct.pack('>BBIBBI', 0, 0, 1, 0, 0, channels)
+            sa3d += struct.pack('>{0}I'.format(channels), *range(channels))
+            entry.children.append(Box(b'SA3D', sa3d))
+
+
+def _promote_chunk_offsets(moov, delta):
+    """Convert stco boxes to co64 where shifting an offset by delta overflows 32 bits.
+
+    Returns:
+        True if any box was converted
+    """
+    promoted = False
+    for trak in moov.children:
+        if trak.type != b'trak':
+            continue
+        stbl = _sample_table(trak)
+        for box in stbl.children if stbl else []:
+            if box.type != b'stco':
+                continue
+            count = struct.unpack_from('>I', box.payload, 4)[0]
+            offsets = struct.unpack_from('>{0}I'.format(count), box.payload, 8)
+            if offsets and max(offsets) + delta > 0xffffffff:
+                box.type = b'co64'
+                box.payload = box.payload[:8] + struct.pack('>{0}Q'.format(count), *offsets)
+                promoted = True
+
+    return promoted
+
+
+def _shift_chunk_offsets(moov, delta):
+    """Add delta to every chunk offset in every track."""
+    for trak in moov.children:
+        if trak.type != b'trak':
+            continue
+        stbl = _sample_table(trak)
+        for box in stbl.children if stbl else []:
+            if box.type not in (b'stco', b'co64'):
+                continue
+            count = struct.unpack_from('>I', box.payload, 4)[0]
+            entry_fmt = '>{0}{1}'.format(count, 'I' if box.type == b'stco' else 'Q')
+            offsets = struct.unpack_from(entry_fmt, box.payload, 8)
+            box.payload = box.payload[:8] + struct.pack(
+                entry_fmt, *[o + delta for o in offsets])
+
+
+def _copy_range(src, dst, offset, size, chunk_size=16 * 2**20):
+    src.seek(offset)
+    remaining = size
+    while remaining:
+        chunk = src.read(min(chunk_size, remaining))
+        if not chunk:
+            raise FinishingError('Unexpected end of file.')
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+
+class Finisher:
+    """Finish stitched videos on a background worker pool.
+
+    This allows finishing of one recording to overlap with stitching of
+    the next.
+
+    Args:
+        stereo_mode: spherical metadata stereo mode, see STEREO_MODES
+        spatial_audio: tag 4 channel audio tracks as ambisonic
+        workers: number of videos finished at a time
+        spherical_video: inject spherical video metadata. Without it, videos
+                         are only remuxed, and tagged for spatial audio.
+        disk_budget: optional DiskBudget. Finishing briefly needs twice the
+                     video's size for its temp files, which is reserved first,
+                     and shrinks as the temp files are written.
+    """
+    def __init__(self, stereo_mode=None, spatial_audio=True, workers=1, disk_budget=None,
+                 spherical_video=True):
+        self.stereo_mode = stereo_mode
+        self.spatial_audio = spatial_audio
+        self.spherical_video = spherical_video
+        self.disk_budget = disk_budget
+        self._pool = ThreadPoolExecutor(max_workers=workers,
+                                        thread_name_prefix='finish')
+        self._futures = []
+
+
+    def submit(self, video_path, dest_path=None):
+        """Queue a stitched video for finishing.
+
+        Args:
+            video_path: path to a stitched video (.mp4) file
+            dest_path: optional path to move the finished video to. If
+                       finishing fails, the unfinished video is moved there.
+        """
+        self._futures.append(self._pool.submit(self._finish, video_path, dest_path))
+
+
+    def wait(self):
+        """Wait for all queued videos to finish.
+
+        Returns:
+            List of paths which could not be finished
+        """
+        self._pool.shutdown(wait=True)
+        return [path for path, ok in (f.result() for f in self._futures) if not ok]
+
+
+    def _finish(self, video_path, dest_path=None):
+        if not os.path.isfile(video_path):
+            print('Skipping finishing, {0} not found.'.format(video_path))
+            return dest_path or video_path, False
+        print('Finishing {0}.'.format(video_path))
+        try:
+            if self.disk_budget is None:
+                finish_stitched_video(video_path, self.stereo_mode, self.spatial_audio,
+                                      dest_path, self.spherical_video)
+            else:
+                with self.disk_budget.reserve(os.path.dirname(video_path),
+                                              2 * os.path.getsize(video_path),
+                                              'finishing {0}'.format(video_path),
+                                              watch_paths=_temp_paths(video_path)):
+                    finish_stitched_video(video_path, self.stereo_mode, self.spatial_audio,
+                                          dest_path, self.spherical_video)
+        except InsufficientSpaceError as e:
+            print('Skipping finishing: {0}'.format(e))
+        except Exception:
+            print('Error finishing {0}:'.format(video_path))
+            traceback.print_exc()
+        else:
+            print('Finished {0}.'.format(dest_path or video_path))
+            return dest_path or video_path, True
+
+        if dest_path:
+            # Don't leave the stitched video hidden, move it into place unfinished
+            try:
+                os.replace(video_path, dest_path)
+                print('Moved unfinished {0} to {1}.'.format(video_path, dest_path))
+            except OSError as e:
+                print('Error moving {0} to {1}: {2}'.format(video_path, dest_path, e))
+        return dest_path or video_path, False
+
+
+def build_finisher(settings_yaml, workers=1, disk_budget=None):
+    """Create a Finisher for videos stitched with a settings YAML file."""
+    mode = load_configuration_from_yaml(settings_yaml).blend.mode
+    spherical_video = mode in STEREO_MODES
+    if not spherical_video:
+        print('Warning: blend mode {0} has no spherical video stereo layout. Finished '
+              'videos will be remuxed for faststart, without spherical video '
+              'metadata.'.format(mode))
+
+    return Finisher(STEREO_MODES.get(mode), workers=workers, disk_budget=disk_budget,
+                    spherical_video=spherical_video)
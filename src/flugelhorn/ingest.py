@@ -0,0 +1,300 @@
+"""Parallel ingest of recordings from several source cards at once.
+
+Every source device (SD card reader, drive) gets its own pool of copy
+workers, so a slow card doesn't hold up the others, and a limit on the
+number of files read from it at a time. All devices share a budget of
+concurrent writes to the destination drive. With a DiskBudget, each
+recording reserves its size on the destination drive before it is copied.
+A recording waiting for space only holds up later recordings from the same
+device.
+
+Each recording is copied into a hidden temp dir in the raw directory, and
+only renamed to its final name once every file has been copied. A failed
+copy is removed, so it is copied again on the next run.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from concurrent.futures import ThreadPoolExecutor, wait
+import os
+import shutil
+import threading
+import time
+
+from flugelhorn.admission import InsufficientSpaceError
+from flugelhorn.file_ops import find_video_image_dirs, partial_path
+
+
+class CardProgress:
+    """Thread-safe copy progress and throughput for a single source card."""
+    def __init__(self, source_dir):
+        self.source_dir = source_dir
+        self.files_total = 0
+        self.bytes_total = 0
+        self.files_done = 0
+        self.bytes_done = 0
+        self.errors = 0
+        self.start_time = None
+        self.end_time = None
+        self._lock = threading.Lock()
+
+
+    def add_file(self, size):
+        self.files_total += 1
+        self.bytes_total += size
+
+
+    def file_started(self):
+        """Record the start of a file copy, for throughput."""
+        with self._lock:
+            if self.start_time is None:
+                self.start_time = time.time()
+
+
+    def file_copied(self, size):
+        with self._lock:
+            now = time.time()
+            self.files_done += 1
+            self.bytes_done += size
+            if self.files_done + self.errors == self.files_total:
+                self.end_time = now
+
+
+    def remove_files(self, count, size):
+        """Remove files that won't be copied from the totals."""
+        with self._lock:
+            self.files_total -= count
+            self.bytes_total -= size
+
+
+    def file_failed(self):
+        with self._lock:
+            self.errors += 1
+            if self.files_done + self.errors == self.files_total:
+                self.end_time = time.time()
+
+
+    @property
+    def throughput(self):
+        """Copy throughput in bytes per second."""
+        if self.start_time is None:
+            return 0
+        elapsed = (self.end_time or time.time()) - self.start_time
+        return self.bytes_done / elapsed if elapsed > 0 else 0
+
+
+    def __repr__(self):
+        percent = 100 * self.bytes_done / self.bytes_total if self.bytes_total else 100
+        report = '{0}: {1}/{2} files, {3:.0f}/{4:.0f} MB ({5:.0f}%), {6:.1f} MB/s'.format(
+            self.source_dir, self.files_done, self.files_total, self.bytes_done / 1e6,
+            self.bytes_total / 1e6, percent, self.throughput / 1e6)
+        if self.errors:
+            report += ', {0} errors'.format(self.errors)
+        return report
+
+
+class _Recording:
+    """A recording directory being copied, file by file."""
+    def __init__(self, source_path, dest_path, is_video, progress):
+        self.source_path = source_path
+        self.dest_path = dest_path
+        self.part_path = partial_path(dest_path)
+        self.is_video = is_video
+        self.progress = progress
+        self.device = os.stat(source_path).st_dev
+        self.dirs = []
+        self.files = []
+        self.size = 0
+        self.remaining = 0
+        self.reservation = None
+        self.failed = False
+        self.lock = threading.Lock()
+
+
+def ingest_sources(source_dirs, raw_dir, files_per_device=2, max_writers=4,
+                   on_copied=None, report_interval=10, disk_budget=None):
+    """Copy all unstitched media from several source dirs to a raw directory.
+
+    Args:
+        source_dirs: source paths to search for image and video directories.
+                     These will likely be SD cards or camera storage devices.
+        raw_dir: destination path for copied directories
+        files_per_device: number of files copied at a time from each device
+        max_writers: number of files written at a time to raw_dir,
+                     shared between all devices
+        on_copied: optional function, called with the raw path of each
+                   video directory as soon as it has been completely copied
+        report_interval: seconds between progress reports
+        disk_budget: optional DiskBudget. Recordings are deferred until
+                     there is space for them on the raw_dir drive, and
+                     skipped if there never will be.
+    Returns:
+        (raw_video_paths, raw_image_paths): tuple containing two lists:
+            raw_video_paths: paths to copied directories containing raw video files
+            raw_image_paths: paths to copied directories containing raw image files
+    """
+    progress = [CardProgress(source_dir) for source_dir in source_dirs]
+    recordings, existing_paths = _plan_recordings(source_dirs, raw_dir, progress)
+
+    # One pool of copy workers per source device
+    pools = {}
+    for recording in recordings:
+        if recording.device not in pools:
+            pools[recording.device] = ThreadPoolExecutor(
+                max_workers=files_per_device,
+                thread_name_prefix='copy-dev{0}'.format(recording.device))
+    write_slots = threading.BoundedSemaphore(max_writers)
+
+    copied_video_paths = []
+    copied_image_paths = []
+    skipped_paths = []
+    failed_paths = []
+    def finish_recording(recording):
+        if recording.reservation is not None:
+            disk_budget.release(recording.reservation)
+        if not recording.failed:
+            try:
+                os.rename(recording.part_path, recording.dest_path)
+            except OSError as e:
+                print('Error moving {0} into place: {1}'.format(recording.part_path, e))
+                recording.failed = True
+        if recording.failed:
+            print('Copy of {0} failed, skipping.'.format(recording.source_path))
+            shutil.rmtree(recording.part_path, ignore_errors=True)
+            failed_paths.append(recording.source_path)
+            return
+        print('Copied {0} to {1}.'.format(recording.source_path, recording.dest_path))
+        if recording.is_video:
+            copied_video_paths.append(recording.dest_path)
+            if on_copied:
+                on_copied(recording.dest_path)
+        else:
+            copied_image_paths.append(recording.dest_path)
+
+    def copy_file(recording, src, dst, size):
+        try:
+            with write_slots:
+                recording.progress.file_started()
+                shutil.copy2(src, dst)
+            if recording.reservation is not None:
+                recording.reservation.consume(size)
+            recording.progress.file_copied(size)
+        except OSError as e:
+            print('Error copying {0}: {1}'.format(src, e))
+            recording.failed = True
+            recording.progress.file_failed()
+        with recording.lock:
+            recording.remaining -= 1
+            done = recording.remaining == 0
+        if done:
+            finish_recording(recording)
+
+    # Each device admits its recordings in order, in its own thread, so a
+    # recording deferred for disk space doesn't hold up the other devices
+    futures = []
+    futures_lock = threading.Lock()
+    def admit_recordings(device_recordings):
+        for recording in device_recordings:
+            if disk_budget is not None:
+                try:
+                    recording.reservation = disk_budget.acquire(
+                        raw_dir, recording.size, recording.source_path)
+                except InsufficientSpaceError as e:
+                    print('Skipping copy: {0}'.format(e))
+                    recording.progress.remove_files(len(recording.files), recording.size)
+                    skipped_paths.append(recording.source_path)
+                    continue
+            # Remove any partial copy left by an interrupted run
+            shutil.rmtree(recording.part_path, ignore_errors=True)
+            for dirpath in recording.dirs:
+                os.makedirs(dirpath, exist_ok=True)
+            if not recording.files:
+                finish_recording(recording)
+            for src, dst, size in recording.files:
+                future = pools[recording.device].submit(copy_file, recording, src, dst, size)
+                with futures_lock:
+                    futures.append(future)
+
+    admit_pool = ThreadPoolExecutor(max_workers=max(1, len(pools)),
+                                    thread_name_prefix='admit')
+    try:
+        admitters = [admit_pool.submit(admit_recordings,
+                                       [r for r in recordings if r.device == device])
+                     for device in pools]
+
+        # Report progress until all recordings are admitted and copied
+        while True:
+            with futures_lock:
+                pending = [f for f in admitters + futures if not f.done()]
+            if not pending:
+                break
+            _, not_done = wait(pending, timeout=report_interval)
+            if not_done:
+                for card in progress:
+                    print(card)
+        for future in admitters + futures:
+            # Raise any unexpected errors from the admission and copy workers
+            future.result()
+    finally:
+        admit_pool.shutdown(wait=True)
+        for pool in pools.values():
+            pool.shutdown(wait=True)
+
+    print('------Copying Complete-------')
+    for card in progress:
+        print(card)
+    for message, paths in [('already in {0}'.format(raw_dir), existing_paths),
+                           ('insufficient space on {0}'.format(raw_dir), skipped_paths),
+                           ('copy failed', failed_paths)]:
+        if paths:
+            print('Not copied, {0}:'.format(message))
+            for path in paths:
+                print(path)
+
+    return copied_video_paths, copied_image_paths
+
+
+def _plan_recordings(source_dirs, raw_dir, progress):
+    """List the recordings and files to be copied from each source.
+
+    Recordings whose name already exists in raw_dir, or on another source,
+    are skipped rather than overwritten.
+
+    Returns:
+        (recordings, existing_paths): the _Recordings to copy, and the
+            source paths skipped because their name already exists
+    """
+    recordings = []
+    existing_paths = []
+    dest_names = set()
+    for source_dir, card_progress in zip(source_dirs, progress):
+        print('Searching source path for files to be stitched: {0}'.format(source_dir))
+        video_dirs, image_dirs = find_video_image_dirs(source_dir)
+        for path, is_video in ([(d, True) for d in video_dirs] +
+                               [(d, False) for d in image_dirs]):
+            folder_name = os.path.split(path)[1]
+            dest_path = os.path.join(raw_dir, folder_name)
+            if folder_name in dest_names or os.path.exists(dest_path):
+                print('Skipping {0}, {1} already exists.'.format(path, dest_path))
+                existing_paths.append(path)
+                continue
+            dest_names.add(folder_name)
+
+            recording = _Recording(path, dest_path, is_video, card_progress)
+            for dirpath, dirnames, filenames in os.walk(path):
+                dest_dirpath = os.path.normpath(
+                    os.path.join(recording.part_path, os.path.relpath(dirpath, path)))
+                recording.dirs.append(dest_dirpath)
+                for filename in sorted(filenames):
+                    src = os.path.join(dirpath, filename)
+                    size = os.path.getsize(src)
+                    recording.files.append((src, os.path.join(dest_dirpath, filename), size))
+                    recording.size += size
+                    card_progress.add_file(size)
+            recording.remaining = len(recording.files)
+            recordings.append(recording)
+
+    return recordings, existing_paths
+
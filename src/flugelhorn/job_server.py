@@ -0,0 +1,335 @@
+"""Local HTTP/JSON server for queueing stitching jobs and checking their status.
+
+Jobs are held in a bounded priority queue and run by a fixed number of
+worker threads. Each worker calls a stitcher function with the signature
+of stitching.stitch_from_raw:
+
+    stitcher(raw_video_dir, stitched_dir, settings_yaml, cancel_event=None)
+
+Endpoints:
+    GET    /jobs         List all jobs.
+    POST   /jobs         Submit a job: {"raw": path, "settings": profile,
+                         "priority": int}. Lower priorities run first.
+                         Only one queued or running job may write to each
+                         stitched output name.
+    GET    /jobs/<id>    Job state, including an excerpt of its stitching log.
+    DELETE /jobs/<id>    Cancel a queued or running job.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import deque
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# Number of stitching log lines returned with a job's status
+LOG_EXCERPT_LINES = 20
+
+
+class JobError(Exception):
+    """Raised when a job can't be submitted or found."""
+
+
+class QueueFullError(JobError):
+    """Raised when the job queue has no room for another job."""
+
+
+class DuplicateJobError(JobError):
+    """Raised when a live job already writes to the same stitched output."""
+
+
+class Job:
+    """A single stitching request and its current state."""
+    def __init__(self, job_id, raw_dir, settings, settings_path, priority, log_path):
+        self.id = job_id
+        self.raw_dir = raw_dir
+        self.settings = settings
+        self.settings_path = settings_path
+        self.priority = priority
+        self.log_path = log_path
+        self.state = QUEUED
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+
+
+    def to_dict(self, include_log=False):
+        """Convenience method for building JSON responses."""
+        job_dict = {
+            'id': self.id,
+            'raw': self.raw_dir,
+            'settings': self.settings,
+            'priority': self.priority,
+            'state': self.state,
+            'error': self.error,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished}
+        if include_log:
+            job_dict['log'] = read_log_excerpt(self.log_path)
+        return job_dict
+
+
+class JobQueue:
+    """Bounded priority queue of stitching jobs feeding stitcher workers.
+
+    Args:
+        stitcher: function used to stitch a job, e.g. stitch_from_raw
+        stitched_dir: directory path for stitched output
+        settings_dir: directory containing <profile>.yaml settings files
+        workers: number of jobs to stitch concurrently
+        max_queued: maximum number of jobs waiting to be stitched
+    """
+    def __init__(self, stitcher, stitched_dir, settings_dir, workers=1, max_queued=16):
+        self.stitcher = stitcher
+        self.stitched_dir = stitched_dir
+        self.settings_dir = settings_dir
+        self.num_workers = workers
+        self.max_queued = max_queued
+        # Unbounded, as cancelled jobs stay in it until a worker skips them.
+        # The bound is enforced on queued jobs in submit().
+        self._queue = queue.PriorityQueue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._threads = []
+
+
+    def start(self):
+        """Start the stitcher worker threads."""
+        for n in range(self.num_workers):
+            thread = threading.Thread(target=self._worker, name='stitcher-{0}'.format(n),
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+
+    def stop(self):
+        """Cancel all outstanding jobs and wait for the workers to exit."""
+        for job in self.jobs():
+            self.cancel(job.id)
+        for _ in self._threads:
+            # None sorts after all jobs, so workers exit once the queue drains
+            self._queue.put((float('inf'), 0, None))
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+    def submit(self, raw_dir, settings, priority=0):
+        """Queue a new stitching job.
+
+        Args:
+            raw_dir: directory path containing raw video files
+            settings: name of a settings profile in settings_dir
+            priority: jobs with lower priorities are stitched first
+        Returns:
+            The new Job
+        Raises:
+            JobError: if the raw dir or settings profile are invalid
+            QueueFullError: if the queue has no room for the job
+            DuplicateJobError: if a queued or running job has the same output
+        """
+        if not isinstance(raw_dir, str):
+            raise JobError('raw must be a path string, was {0!r}.'.format(raw_dir))
+        if not isinstance(settings, str):
+            raise JobError('settings must be a profile name, was {0!r}.'.format(settings))
+        if not raw_dir or not os.path.isdir(raw_dir):
+            raise JobError('{0} is not a directory.'.format(raw_dir))
+        settings_path = self._settings_path(settings)
+        try:
+            priority = int(priority)
+        except (TypeError, ValueError):
+            raise JobError('priority must be an integer, was {0!r}.'.format(priority))
+
+        raw_dir = os.path.abspath(raw_dir)
+        name = os.path.split(raw_dir)[1]
+        log_path = '{0}.log'.format(os.path.join(self.stitched_dir, name))
+        with self._lock:
+            live_jobs = [j for j in self._jobs.values() if j.state in (QUEUED, RUNNING)]
+            for live_job in live_jobs:
+                # Jobs with the same name write the same .xml, .log and .mp4
+                if os.path.split(live_job.raw_dir)[1] == name:
+                    raise DuplicateJobError('Job {0} for {1} is already {2}.'.format(
+                        live_job.id, name, live_job.state))
+            if sum(j.state == QUEUED for j in live_jobs) >= self.max_queued:
+                raise QueueFullError('Job queue is full ({0} jobs).'.format(
+                    self.max_queued))
+            job = Job(next(self._ids), raw_dir, settings, settings_path, priority, log_path)
+            self._queue.put((priority, job.id, job))
+            self._jobs[job.id] = job
+        print('Queued job {0}: {1}'.format(job.id, raw_dir))
+
+        return job
+
+
+    def get(self, job_id):
+        """Return a job by id.
+
+        Raises:
+            JobError: if no job has that id
+        """
+        try:
+            return self._jobs[job_id]
+        except KeyError:
+            raise JobError('Job {0} not found.'.format(job_id))
+
+
+    def jobs(self):
+        """Return all jobs, in submission order."""
+        with self._lock:
+            return [self._jobs[job_id] for job_id in sorted(self._jobs)]
+
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Finished jobs are left unchanged."""
+        job = self.get(job_id)
+        with self._lock:
+            if job.state == QUEUED:
+                job.state = CANCELLED
+                job.finished = time.time()
+            job.cancel_event.set()
+
+        return job
+
+
+    def _settings_path(self, settings):
+        """Resolve a settings profile name to a YAML file in settings_dir."""
+        if not settings or os.path.basename(settings) != settings:
+            raise JobError('Invalid settings profile {0!r}.'.format(settings))
+        name = settings if settings.endswith('.yaml') else '{0}.yaml'.format(settings)
+        settings_path = os.path.join(self.settings_dir, name)
+        if not os.path.isfile(settings_path):
+            raise JobError('Settings profile {0!r} not found.'.format(settings))
+
+        return settings_path
+
+
+    def _worker(self):
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                if job.state != QUEUED:
+                    continue
+                job.state = RUNNING
+                job.started = time.time()
+            print('Starting job {0}: {1}'.format(job.id, job.raw_dir))
+            try:
+                self.stitcher(job.raw_dir, self.stitched_dir, job.settings_path,
+                              cancel_event=job.cancel_event)
+                state = CANCELLED if job.cancel_event.is_set() else DONE
+            except Exception as e:
+                traceback.print_exc()
+                job.error = '{0}: {1}'.format(type(e).__name__, e)
+                state = FAILED
+            with self._lock:
+                job.state = state
+                job.finished = time.time()
+            print('Finished job {0}: {1}'.format(job.id, state))
+
+
+def read_log_excerpt(log_path, num_lines=LOG_EXCERPT_LINES):
+    """Return the last lines of a log file, or an empty list if it doesn't exist."""
+    try:
+        with open(log_path, 'r', errors='replace') as f:
+            return [line.rstrip('\n') for line in deque(f, maxlen=num_lines)]
+    except FileNotFoundError:
+        return []
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """JSON request handler for a JobServer."""
+
+    def do_GET(self):
+        parts = self._path_parts()
+        if parts == ['jobs']:
+            self._send_json(200, {'jobs': [job.to_dict() for job in
+                                           self.server.job_queue.jobs()]})
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            self._with_job(parts[1], lambda job_id: self.server.job_queue.get(job_id))
+        else:
+            self._send_json(404, {'error': 'Not found.'})
+
+
+    def do_POST(self):
+        if self._path_parts() != ['jobs']:
+            self._send_json(404, {'error': 'Not found.'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            job = self.server.job_queue.submit(request.get('raw'),
+                                               request.get('settings'),
+                                               request.get('priority', 0))
+        except QueueFullError as e:
+            self._send_json(503, {'error': str(e)})
+        except DuplicateJobError as e:
+            self._send_json(409, {'error': str(e)})
+        except (JobError, ValueError, AttributeError) as e:
+            self._send_json(400, {'error': str(e)})
+        else:
+            self._send_json(201, job.to_dict())
+
+
+    def do_DELETE(self):
+        parts = self._path_parts()
+        if len(parts) == 2 and parts[0] == 'jobs':
+            self._with_job(parts[1], lambda job_id: self.server.job_queue.cancel(job_id))
+        else:
+            self._send_json(404, {'error': 'Not found.'})
+
+
+    def log_message(self, format, *args):
+        # Keep request logging consistent with the rest of flugelhorn's output
+        print('{0} - {1}'.format(self.address_string(), format % args))
+
+
+    def _path_parts(self):
+        return [part for part in urlparse(self.path).path.split('/') if part]
+
+
+    def _with_job(self, raw_id, action):
+        try:
+            job = action(int(raw_id))
+        except (JobError, ValueError):
+            self._send_json(404, {'error': 'Job {0} not found.'.format(raw_id)})
+        else:
+            self._send_json(200, job.to_dict(include_log=True))
+
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class JobServer(ThreadingHTTPServer):
+    """HTTP server exposing a JobQueue."""
+    daemon_threads = True
+
+    def __init__(self, address, job_queue):
+        super().__init__(address, JobRequestHandler)
+        self.job_queue = job_queue
@@ -0,0 +1,146 @@
+"""Profiling helpers for timing and inspecting pipeline stages.
+
+Each stage of a run can be wrapped with cProfile and/or tracemalloc.
+Per-stage reports are written to disk, and a combined hotspot summary
+can be printed once the run is complete. The resulting .pstats files can
+be inspected further with pstats or tools such as snakeviz.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import re
+import time
+import tracemalloc
+
+
+# Directory (within the output dir) that stage reports are written to
+PROFILE_DIRNAME = 'profile'
+
+
+class StageProfiler:
+    """Collect cProfile and tracemalloc reports for named pipeline stages.
+
+    With both profile and trace_malloc disabled, stage() does nothing,
+    so a StageProfiler can always be passed through the pipeline.
+
+    Args:
+        output_dir: directory to write reports to, in a profile/ subdirectory
+        profile: record a cProfile .pstats file per stage
+        trace_malloc: record a tracemalloc top allocations report per stage
+        top_n: number of entries in reports and the summary
+    """
+    def __init__(self, output_dir=None, profile=False, trace_malloc=False, top_n=20):
+        self.output_dir = output_dir
+        self.profile = profile
+        self.trace_malloc = trace_malloc
+        self.top_n = top_n
+        # (stage name, wall seconds, peak traced bytes or None)
+        self.stages = []
+        self._pstats_paths = []
+        self._top_allocations = []
+
+
+    @property
+    def enabled(self):
+        return self.profile or self.trace_malloc
+
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager profiling the code it wraps as a single stage."""
+        if not self.enabled:
+            yield
+            return
+
+        report_base = self._report_base(name)
+        profiler = cProfile.Profile() if self.profile else None
+        if self.trace_malloc:
+            tracemalloc.start()
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+            elapsed = time.perf_counter() - start
+            peak = None
+            if profiler:
+                pstats_path = '{0}.pstats'.format(report_base)
+                profiler.dump_stats(pstats_path)
+                self._pstats_paths.append(pstats_path)
+            if self.trace_malloc:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                self._write_malloc_report(name, snapshot, peak, report_base)
+            self.stages.append((name, elapsed, peak))
+
+
+    def summary(self):
+        """Return a printable summary of all profiled stages."""
+        out = io.StringIO()
+        out.write('------Profiling Summary-------\n')
+        for name, elapsed, peak in self.stages:
+            line = '{0}: {1:.3f}s'.format(name, elapsed)
+            if peak is not None:
+                line += ', peak {0:.1f} MiB traced'.format(peak / 2**20)
+            out.write(line + '\n')
+
+        if self._pstats_paths:
+            out.write('\nTop {0} functions by internal time, all stages:\n'.format(self.top_n))
+            stats = pstats.Stats(*self._pstats_paths, stream=out)
+            stats.sort_stats('tottime').print_stats(self.top_n)
+
+        if self._top_allocations:
+            out.write('Top {0} allocation sites, all stages:\n'.format(self.top_n))
+            top = sorted(self._top_allocations, key=lambda a: a[2], reverse=True)
+            for name, location, size in top[:self.top_n]:
+                out.write('{0:>10.1f} KiB  {1}  [{2}]\n'.format(size / 1024, location, name))
+
+        if self.output_dir:
+            out.write('\nReports written to {0}\n'.format(self._report_dir()))
+
+        return out.getvalue()
+
+
+    def _report_dir(self):
+        return os.path.join(self.output_dir, PROFILE_DIRNAME)
+
+
+    def _report_base(self, name):
+        """Return the report path (without extension) for a stage."""
+        report_dir = self._report_dir()
+        os.makedirs(report_dir, exist_ok=True)
+        filename = re.sub(r'[^\w.-]', '_', name)
+        return os.path.join(report_dir, filename)
+
+
+    def _write_malloc_report(self, name, snapshot, peak, report_base):
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>')])
+        top_stats = snapshot.statistics('lineno')[:self.top_n]
+        with open('{0}.malloc.txt'.format(report_base), 'w') as f:
+            f.write('Stage: {0}\n'.format(name))
+            f.write('Peak traced memory: {0} bytes\n'.format(peak))
+            f.write('Top {0} allocation sites still held at end of stage:\n'.format(
+                self.top_n))
+            for stat in top_stats:
+                f.write('{0}\n'.format(stat))
+        for stat in top_stats:
+            frame = stat.traceback[0]
+            location = '{0}:{1}'.format(frame.filename, frame.lineno)
+            self._top_allocations.append((name, location, stat.size))
+
+
+# Shared no-op profiler for callers that don't profile
+NULL_PROFILER = StageProfiler()
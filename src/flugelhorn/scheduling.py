@@ -0,0 +1,184 @@
+"""Stitch job scheduling and ETA estimates based on past throughput.
+
+Throughput is measured as seconds of stitched output per wall-clock
+second, and is stored per settings profile and output resolution in a
+small JSON history file.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import namedtuple
+import datetime
+import json
+import os
+import statistics
+import time
+
+
+DEFAULT_HISTORY_PATH = os.path.join(os.path.expanduser('~'), '.flugelhorn', 'throughput.json')
+
+# Number of past runs kept per profile and resolution
+MAX_SAMPLES = 20
+
+ORDERS = ['scan', 'shortest', 'deadline']
+
+# A recording to be stitched
+# raw_dir: directory path containing raw video files
+# duration: seconds of video, or None if it couldn't be probed
+# runtime: estimated seconds to stitch, or None without throughput history
+# deadline: datetime the stitch should be finished by, or None
+StitchJob = namedtuple('StitchJob', 'raw_dir duration runtime deadline')
+
+
+class ThroughputHistory:
+    """Stitching throughput of past runs, persisted to a JSON file."""
+    def __init__(self, path=DEFAULT_HISTORY_PATH):
+        self.path = path
+        try:
+            with open(path, 'r') as f:
+                self._samples = json.load(f)
+        except FileNotFoundError:
+            self._samples = {}
+        except ValueError:
+            print('Ignoring unreadable throughput history {0}.'.format(path))
+            self._samples = {}
+
+
+    def estimate(self, key):
+        """Return the median throughput for a key, or None if there is no history."""
+        samples = self._samples.get(key)
+        if not samples:
+            return None
+        return statistics.median(samples)
+
+
+    def record(self, key, output_seconds, wall_seconds):
+        """Add a completed run, keeping only the most recent samples."""
+        if output_seconds <= 0 or wall_seconds <= 0:
+            return
+        samples = self._samples.setdefault(key, [])
+        samples.append(output_seconds / wall_seconds)
+        del samples[:-MAX_SAMPLES]
+
+
+    def save(self):
+        """Write the history file atomically."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = '{0}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as f:
+            json.dump(self._samples, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def written_since(path, start):
+    """Return whether a file was written at or after a start time.
+
+    Used to check that a stitched video was written by the run that
+    started at start, not left over from an earlier run.
+    """
+    try:
+        # Whole seconds, for file systems with coarse modification times
+        return os.path.getmtime(path) >= int(start)
+    except OSError:
+        return False
+
+
+def throughput_key(settings_yaml, config):
+    """Return the history key for a settings profile, e.g. 'daily_mono@3840x1920'."""
+    profile = os.path.splitext(os.path.basename(settings_yaml))[0]
+    return '{0}@{1}x{2}'.format(profile, config.output.width, config.output.height)
+
+
+def parse_deadlines(deadline_args):
+    """Parse NAME=YYYY-MM-DDTHH:MM deadline arguments into a dict of datetimes.
+
+    Raises:
+        ValueError: if an argument is not in the expected format
+    """
+    deadlines = {}
+    for arg in deadline_args or []:
+        name, sep, when = arg.partition('=')
+        if not sep:
+            raise ValueError('Deadline {0!r} must be NAME=YYYY-MM-DDTHH:MM.'.format(arg))
+        deadlines[name] = datetime.datetime.strptime(when, '%Y-%m-%dT%H:%M')
+
+    return deadlines
+
+
+def plan_jobs(raw_dirs, durations, throughput=None, order='shortest', deadlines=None):
+    """Build and order stitch jobs.
+
+    Args:
+        raw_dirs: directory paths containing raw video files, in scan order
+        durations: dict of raw dir -> seconds of video (or None if unknown)
+        throughput: seconds of output stitched per wall second, or None
+        order: 'scan' keeps the given order, 'shortest' stitches the
+               shortest recordings first, and 'deadline' stitches those with
+               the earliest deadline first, then the rest shortest first.
+        deadlines: dict of recording name -> datetime
+    Returns:
+        Ordered list of StitchJobs
+    """
+    if order not in ORDERS:
+        raise ValueError('order must be in {0!r}, was {1}'.format(ORDERS, order))
+    deadlines = deadlines or {}
+
+    jobs = []
+    for raw_dir in raw_dirs:
+        duration = durations.get(raw_dir)
+        runtime = duration / throughput if duration is not None and throughput else None
+        deadline = deadlines.get(os.path.split(raw_dir)[1])
+        jobs.append(StitchJob(raw_dir, duration, runtime, deadline))
+
+    def shortest_key(job):
+        # Recordings of unknown length go last
+        return (job.duration is None, job.duration or 0)
+
+    if order == 'shortest':
+        jobs.sort(key=shortest_key)
+    elif order == 'deadline':
+        jobs.sort(key=lambda job: ((job.deadline is None, job.deadline or datetime.datetime.min),
+                                   shortest_key(job)))
+
+    return jobs
+
+
+def format_batch_eta(jobs, key=None, start=None):
+    """Return a printable schedule of jobs with estimated finish times."""
+    start = time.time() if start is None else start
+    lines = ['------Stitching Schedule-------']
+    elapsed = 0
+    unknown = 0
+    for job in jobs:
+        name = os.path.split(job.raw_dir)[1]
+        duration = '{0:.0f}s'.format(job.duration) if job.duration is not None else '?'
+        if job.runtime is None or unknown:
+            unknown += 1
+            finish = '?'
+        else:
+            elapsed += job.runtime
+            finish = _format_time(start + elapsed)
+        line = '{0}: {1} of video, finishes {2}'.format(name, duration, finish)
+        if job.deadline:
+            line += ', deadline {0}'.format(job.deadline.strftime('%Y-%m-%d %H:%M'))
+            if finish != '?' and start + elapsed > job.deadline.timestamp():
+                line += ' (LATE)'
+        lines.append(line)
+
+    if not jobs:
+        lines.append('No recordings to stitch.')
+    elif unknown == len(jobs) and key:
+        lines.append('No throughput history for {0}, batch ETA unknown.'.format(key))
+    elif unknown:
+        lines.append('Batch ETA unknown, no estimate for {0} recordings.'.format(unknown))
+    else:
+        lines.append('Batch ETA: {0} ({1:.0f} minutes).'.format(
+            _format_time(start + elapsed), elapsed / 60))
+
+    return '\n'.join(lines)
+
+
+def _format_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M')
@@ -11,6 +11,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import functools
+
 from flugelhorn.setting_definitions import SETTING_DEFINITIONS
 
 
@@ -132,8 +134,14 @@ def setting_factory(setting_name, properties):
     return type(setting_name, (Setting,), cls_attrs)
 
 
+@functools.lru_cache(maxsize=None)
 def build_config_template():
-    """Return a configuration template for stitching settings."""
+    """Return a configuration template for stitching settings.
+
+    The generated classes only depend on SETTING_DEFINITIONS, so they are
+    built once per process and reused. Instances are still created fresh
+    by initialize_settings.
+    """
     # Naively create a dict object with values as record objects
     config_template = setting_factory('settings', SETTING_DEFINITIONS)
 
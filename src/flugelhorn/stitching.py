@@ -4,22 +4,40 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import contextlib
 import os
 import platform
 import subprocess
+import time
 
-from flugelhorn.config_builder import create_and_write_stitching_config_from_raw
+from flugelhorn.admission import AdmissionCancelled
+from flugelhorn.config_builder import (create_and_write_stitching_config_from_raw,
+                                       probe_recording_duration)
+from flugelhorn.profiling import NULL_PROFILER
+from flugelhorn.yaml_utils import load_configuration_from_yaml
 
 
 OSX_STITCHER_APP = '/Applications/Insta360Stitcher.app/Contents/Resources/tools/ProStitcher/ProStitcher'
 WINDOWS_STITCHER_APP = 'C:\\Program Files (x86)\\Insta360Stitcher\\tools\\prostitcher\\proStitcher.exe'
 
+# Seconds between checks for cancellation while the stitching app runs
+CANCEL_POLL_INTERVAL = 1
+
+# Allowance for audio and container overhead on top of the video bitrate
+FOOTPRINT_MARGIN = 1.05
+
 
 class StitcherInstallError(Exception):
     """Raised when Insta360 ProStitcher not found."""
 
 
-def stitch_from_raw(raw_video_dir, stitched_dir, settings_yaml):
+class StitchingError(Exception):
+    """Raised when the stitching app exits with an error."""
+
+
+def stitch_from_raw(raw_video_dir, stitched_dir, settings_yaml, cancel_event=None,
+                    profiler=NULL_PROFILER, auto_color=False, disk_budget=None,
+                    hidden_output=False, on_stitched=None):
     """Stitch the files in a directory based on user-defined settings.
 
     Parses user-defined settings YAML file for base settings.
@@ -34,10 +52,29 @@ def stitch_from_raw(raw_video_dir, stitched_dir, settings_yaml):
                        pro.prj file, and gyro.dat file
         stitched_dir: directory path to output stitched video (.mp4) file
         settings_yaml: path to a settings YAML file
+        cancel_event: optional threading.Event. If it is set, the stitching
+                      app is stopped (or never started), also while
+                      waiting for disk space.
+        profiler: optional StageProfiler. Config building and stitching
+                  are profiled as separate stages.
+        auto_color: fill unset color settings from an analysis of the raw video
+        disk_budget: optional DiskBudget. The stitching app is only run once
+                     the estimated output size fits on the stitched_dir drive.
+        hidden_output: write the stitched video to a hidden .<name>.mp4 file,
+                       e.g. so that it can be finished before it is visible
+        on_stitched: optional function, called with the stitched video path
+                     and the seconds the stitching app ran for, once it has
+                     finished without being cancelled
     Returns:
-        None
-    """ 
-    xml_save_path = create_and_write_stitching_config_from_raw(raw_video_dir, stitched_dir, settings_yaml)
+        Path to the stitched video (.mp4) file
+    Raises:
+        StitchingError: if the stitching app fails
+        InsufficientSpaceError: if the output will never fit on the drive
+    """
+    name = os.path.split(raw_video_dir)[1]
+    with profiler.stage('{0}.config'.format(name)):
+        xml_save_path = create_and_write_stitching_config_from_raw(
+            raw_video_dir, stitched_dir, settings_yaml, auto_color, hidden_output)
         
     # Write XML for stitching
     # stitched_path = os.path.join(stitched_dir, os.path.split(raw_video_dir)[1])
@@ -45,17 +82,88 @@ def stitch_from_raw(raw_video_dir, stitched_dir, settings_yaml):
     # write_config_xml(config, stitch_source, xml_save_path)
 
     # Run stitching
-    log_path = '{0}.log'.format(os.path.join(stitched_dir, os.path.split(raw_video_dir)[1]))
-    run_stitching_app(xml_save_path, log_path)
+    log_path = '{0}.log'.format(os.path.join(stitched_dir, name))
+    output_name = '.{0}'.format(name) if hidden_output else name
+    stitched_path = '{0}.mp4'.format(os.path.join(stitched_dir, output_name))
+    if disk_budget is None:
+        reservation = contextlib.nullcontext()
+    else:
+        footprint = estimate_stitch_footprint(raw_video_dir, settings_yaml)
+        reservation = disk_budget.reserve(stitched_dir, footprint, stitched_path,
+                                          watch_paths=[stitched_path],
+                                          cancel_event=cancel_event)
+    try:
+        with reservation:
+            if cancel_event is not None and cancel_event.is_set():
+                return stitched_path
+            with profiler.stage('{0}.stitch'.format(name)):
+                start = time.time()
+                run_stitching_app(xml_save_path, log_path, cancel_event)
+                elapsed = time.time() - start
+            if on_stitched is not None and not (cancel_event is not None and
+                                                cancel_event.is_set()):
+                on_stitched(stitched_path, elapsed)
+    except AdmissionCancelled:
+        pass
+
+    return stitched_path
+
+
+def estimate_stitch_footprint(raw_video_dir, settings_yaml):
+    """Estimate the size of a stitched video from its bitrate and duration.
+
+    Returns:
+        Estimated size in bytes, or 0 if the duration can't be probed
+    """
+    config = load_configuration_from_yaml(settings_yaml)
+    duration = probe_recording_duration(raw_video_dir)
+    if duration is None:
+        return 0
+    return int(config.video.bitrate / 8 * duration * FOOTPRINT_MARGIN)
 
 
-def run_stitching_app(xml_path, log_path):
+def run_stitching_app(xml_path, log_path, cancel_event=None):
     """Run the local machine stitching app w/ XML file settings.
     
     This currently supports the Insta360 ProStitcher app only.
+
+    Args:
+        xml_path: path to XML stitching settings
+        log_path: path for the stitching app's log file
+        cancel_event: optional threading.Event. The app is terminated
+                      if the event is set while it is running.
+    Raises:
+        StitchingError: if the app exits with a non-zero code, other than
+                        when it is cancelled
     """
     stitching_app = get_stitching_app_path()
-    subprocess.run([stitching_app, '-l', log_path, '-x', xml_path, '-w', 'stitch'])
+    # Run the app in its own process group, so that a Ctrl-C in the terminal
+    # only reaches this process, which decides whether to stop the app
+    if platform.system() == 'Windows':
+        group_kwargs = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        group_kwargs = {'start_new_session': True}
+    process = subprocess.Popen(
+        [stitching_app, '-l', log_path, '-x', xml_path, '-w', 'stitch'], **group_kwargs)
+    try:
+        while True:
+            try:
+                process.wait(timeout=CANCEL_POLL_INTERVAL)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel_event is not None and cancel_event.is_set():
+                    print('Cancelling stitch of {0}.'.format(xml_path))
+                    process.terminate()
+                    process.wait()
+                    return
+    except BaseException:
+        # e.g. KeyboardInterrupt, don't leave the app running without us
+        process.terminate()
+        process.wait()
+        raise
+    if process.returncode != 0:
+        raise StitchingError('Stitching app exited with code {0}, see {1}.'.format(
+            process.returncode, log_path))
 
 
 def get_stitching_app_path():
@@ -0,0 +1,87 @@
+"""Keyframe thumbnail and contact sheet extraction from raw lens videos."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import imageio
+import numpy as np
+
+from flugelhorn.config_builder import build_stitching_source
+from flugelhorn.video_utils import NUM_LENSES, KeyframeError, extract_keyframe, sample_times
+
+
+def tile_frames(frames, columns):
+    """Tile equally sized frames into a single image, row by row."""
+    rows = -(-len(frames) // columns)
+    height, width, channels = frames[0].shape
+    sheet = np.zeros((rows * height, columns * width, channels), np.uint8)
+    for n, frame in enumerate(frames):
+        row, col = divmod(n, columns)
+        sheet[row * height:(row + 1) * height, col * width:(col + 1) * width] = frame
+
+    return sheet
+
+
+def make_contact_sheet(raw_video_dir, output_dir, lenses=range(NUM_LENSES),
+                       num_frames=4, width=320):
+    """Write a contact sheet JPEG for a raw video directory.
+
+    Each row of the sheet is a moment in the recording, and each column
+    is a lens.
+
+    Args:
+        raw_video_dir: directory path containing raw video (.mp4) files
+        output_dir: directory to write <recording>_contact.jpg to
+        lenses: lens indexes to include
+        num_frames: number of moments (rows) to sample
+        width: width of each thumbnail in pixels
+    Returns:
+        Path to the contact sheet
+    """
+    lenses = list(lenses)
+    stitch_source = build_stitching_source(raw_video_dir)
+    if not stitch_source.media:
+        raise KeyframeError('No videos found in {0}.'.format(raw_video_dir))
+    source_width, source_height = stitch_source.media[0]['size']
+    # Even dimensions, as required by most ffmpeg pixel formats
+    size = (width, 2 * max(1, round(width * source_height / source_width / 2)))
+
+    frames = []
+    for group, timestamp in sample_times(stitch_source.media, num_frames):
+        for lens in lenses:
+            frames.append(extract_keyframe(group[lens], timestamp, size))
+    sheet = tile_frames(frames, len(lenses))
+
+    name = os.path.split(raw_video_dir)[1]
+    sheet_path = os.path.join(output_dir, '{0}_contact.jpg'.format(name))
+    imageio.imwrite(sheet_path, sheet, quality=85)
+
+    return sheet_path
+
+
+def make_contact_sheets(raw_video_dirs, output_dir, lenses=range(NUM_LENSES),
+                        num_frames=4, width=320, workers=None):
+    """Write contact sheets for many recordings in parallel processes.
+
+    Returns:
+        List of contact sheet paths, or None for recordings that failed
+    """
+    lenses = list(lenses)
+    sheet_paths = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(make_contact_sheet, raw_video_dir, output_dir, lenses,
+                               num_frames, width)
+                   for raw_video_dir in raw_video_dirs]
+        for raw_video_dir, future in zip(raw_video_dirs, futures):
+            try:
+                sheet_paths.append(future.result())
+                print('Wrote {0}'.format(sheet_paths[-1]))
+            except Exception as e:
+                print('Error creating contact sheet for {0}: {1}'.format(raw_video_dir, e))
+                sheet_paths.append(None)
+
+    return sheet_paths
@@ -0,0 +1,77 @@
+"""Video utilities for reading frames from raw lens videos.
+
+Frames are read by seeking straight to keyframes with ffmpeg, without
+decoding the frames in between, so a handful of frames can be pulled
+from a long recording in seconds.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import subprocess
+
+import imageio
+import numpy as np
+
+
+# Lens videos per video group, origin_0.mp4 - origin_5.mp4
+NUM_LENSES = 6
+
+
+class KeyframeError(Exception):
+    """Raised when a keyframe can't be extracted."""
+
+
+def extract_keyframe(mp4_file, timestamp, size):
+    """Decode the keyframe nearest before a timestamp, scaled to a size.
+
+    Args:
+        mp4_file: path to a video file
+        timestamp: time in seconds to seek to
+        size: (width, height) of the returned frame
+    Returns:
+        uint8 numpy array of shape (height, width, 3)
+    Raises:
+        KeyframeError: if ffmpeg fails or returns no frame
+    """
+    width, height = size
+    ffmpeg = imageio.plugins.ffmpeg.get_exe()
+    # Input seeking lands on a keyframe, and skip_frame stops ffmpeg
+    # decoding anything other than keyframes
+    result = subprocess.run(
+        [ffmpeg, '-v', 'error', '-skip_frame', 'nokey', '-noaccurate_seek',
+         '-ss', '{0:.3f}'.format(timestamp), '-i', mp4_file, '-an',
+         '-frames:v', '1', '-vf', 'scale={0}:{1}'.format(width, height),
+         '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    frame_bytes = width * height * 3
+    if result.returncode != 0 or len(result.stdout) < frame_bytes:
+        raise KeyframeError('No keyframe at {0:.3f}s in {1}: {2}'.format(
+            timestamp, mp4_file, result.stderr.decode('utf-8', 'replace').strip()))
+
+    return np.frombuffer(result.stdout[:frame_bytes], np.uint8).reshape(height, width, 3)
+
+
+def sample_times(video_groups, num_frames):
+    """Spread timestamps evenly over all video groups of a recording.
+
+    Args:
+        video_groups: StitchSource.media video groups
+        num_frames: number of timestamps
+    Returns:
+        List of (video group, time within the group) tuples
+    """
+    durations = [group['end'] - group['start'] for group in video_groups]
+    total = sum(durations)
+    samples = []
+    for n in range(num_frames):
+        # Midpoints of equal slices, avoiding the very first and last frames
+        t = total * (n + 0.5) / num_frames
+        for group, duration in zip(video_groups, durations):
+            if t < duration or group is video_groups[-1]:
+                samples.append((group, group['start'] + min(t, duration)))
+                break
+            t -= duration
+
+    return samples
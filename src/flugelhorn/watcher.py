@@ -0,0 +1,106 @@
+"""Watch folder module for detecting newly arrived capture directories."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+
+from flugelhorn.file_ops import dir_snapshot
+
+
+# A capture directory is only considered once the camera's project file exists
+PROJECT_FILENAME = 'pro.prj'
+
+
+class FolderWatcher:
+    """Poll a set of directories for capture folders that have stopped changing.
+
+    Each watched directory is scanned with os.scandir. A capture folder is
+    reported once its file count, total size and latest modification time
+    have been unchanged for at least settle_time seconds. It is only
+    reported once per watcher, unless it is forgotten with forget(), e.g.
+    because processing it failed.
+
+    Args:
+        watch_dirs: directories to scan for capture folders
+        settle_time: seconds a folder must be unchanged before it is reported
+        retry_delay: seconds before a forgotten folder can be reported again.
+                     The delay doubles each time the same folder is forgotten.
+        max_retry_delay: longest delay before a forgotten folder is retried
+        clock: function returning the current time in seconds
+    """
+    def __init__(self, watch_dirs, settle_time=30, retry_delay=60, max_retry_delay=3600,
+                 clock=time.monotonic):
+        self.watch_dirs = list(watch_dirs)
+        self.settle_time = settle_time
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._clock = clock
+        # path -> (snapshot, time the snapshot was first seen)
+        self._pending = {}
+        self._reported = set()
+        # path -> (number of times forgotten, time it may be reported again)
+        self._retries = {}
+
+
+    def poll(self):
+        """Scan the watched directories once.
+
+        Returns:
+            List of capture folder paths that have become stable since
+            the last poll, in the order they were found.
+        """
+        now = self._clock()
+        stable = []
+        for path in self._candidate_dirs():
+            if path in self._reported:
+                continue
+            if path in self._retries and now < self._retries[path][1]:
+                continue
+            try:
+                snapshot = dir_snapshot(path)
+            except FileNotFoundError:
+                # Removed (or the card was ejected) while scanning
+                self._pending.pop(path, None)
+                continue
+
+            previous = self._pending.get(path)
+            if previous is None or previous[0] != snapshot:
+                self._pending[path] = (snapshot, now)
+            elif now - previous[1] >= self.settle_time:
+                del self._pending[path]
+                self._reported.add(path)
+                stable.append(path)
+
+        return stable
+
+
+    def forget(self, path):
+        """Allow a reported folder to be reported again, after a retry delay.
+
+        Returns:
+            Seconds until the folder may be reported again
+        """
+        failures = self._retries.get(path, (0, None))[0] + 1
+        delay = min(self.retry_delay * 2 ** (failures - 1), self.max_retry_delay)
+        self._retries[path] = (failures, self._clock() + delay)
+        self._reported.discard(path)
+        self._pending.pop(path, None)
+
+        return delay
+
+
+    def _candidate_dirs(self):
+        """Yield capture folders in all watched directories."""
+        for watch_dir in self.watch_dirs:
+            try:
+                entries = sorted(os.scandir(watch_dir), key=lambda e: e.name)
+            except FileNotFoundError:
+                # Mount point not currently available
+                continue
+            for entry in entries:
+                if entry.is_dir() and os.path.isfile(
+                        os.path.join(entry.path, PROJECT_FILENAME)):
+                    yield entry.path
@@ -4,11 +4,17 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+
 from ruamel.yaml import YAML
 
 from flugelhorn.stitcher_settings import build_config_template, initialize_settings
 
 
+# Parsed YAML files, keyed by path and modification time, so long-running
+# processes don't re-read unchanged settings files for every stitch.
+_YAML_CACHE = {}
+
 def load_configuration_from_yaml(yaml_path):
     """Load Stitcher configuration from yaml file.
 
@@ -26,12 +32,18 @@ def load_configuration_from_yaml(yaml_path):
 
 
 def _load_yaml_to_dict(path):
-    """Read a YAML file into a py dict."""
-    with open(path, 'r') as f:
-        yaml = YAML(typ='safe')
-        data = yaml.load(f)
+    """Read a YAML file into a py dict.
+
+    Results are cached until the file's modification time changes.
+    The returned dict is shared, and must not be modified by callers.
+    """
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+    if key not in _YAML_CACHE:
+        with open(path, 'r') as f:
+            yaml = YAML(typ='safe')
+            _YAML_CACHE[key] = yaml.load(f)
 
-    return data
+    return _YAML_CACHE[key]
 
 
 def _parse_yaml_dict(settings_dict):
@@ -0,0 +1,44 @@
+"""Shared fixtures for tests that need real video files."""
+
+import subprocess
+
+import imageio
+import pytest
+from flugelhorn.video_utils import NUM_LENSES
+
+
+# Gray level of each lens's test video, so that lenses can be told apart
+LENS_LEVELS = [40 * (lens + 1) for lens in range(NUM_LENSES)]
+
+
+@pytest.fixture
+def lens_levels():
+    return LENS_LEVELS
+
+
+@pytest.fixture(scope='session')
+def ffmpeg():
+    try:
+        return imageio.plugins.ffmpeg.get_exe()
+    except Exception as e:
+        pytest.skip('ffmpeg not available: {0}'.format(e))
+
+
+def write_test_video(ffmpeg, path, level, size='64x32', duration=2):
+    """Write a solid gray test video, with a keyframe every half second."""
+    subprocess.run(
+        [ffmpeg, '-v', 'error', '-y', '-f', 'lavfi',
+         '-i', 'color=c=0x{0:02x}{0:02x}{0:02x}:size={1}:rate=10:duration={2}'.format(
+             level, size, duration),
+         '-g', '5', '-pix_fmt', 'yuv420p', path], check=True)
+
+
+@pytest.fixture
+def raw_recording(tmpdir, ffmpeg):
+    """A raw video directory: six lens videos, a preview video and pro.prj."""
+    raw_dir = tmpdir.mkdir('VID_20180101_000000_000')
+    for lens, level in enumerate(LENS_LEVELS):
+        write_test_video(ffmpeg, str(raw_dir.join('origin_{0}.mp4'.format(lens))), level)
+    write_test_video(ffmpeg, str(raw_dir.join('preview.mp4')), 0)
+    raw_dir.join('pro.prj').write('')
+    return raw_dir
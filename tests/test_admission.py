@@ -0,0 +1,76 @@
+"""Tests of disk space admission control."""
+
+from collections import namedtuple
+import threading
+
+import pytest
+from flugelhorn import admission
+
+
+FakeUsage = namedtuple('FakeUsage', 'free')
+
+
+# Fixtures
+@pytest.fixture
+def budget():
+    return admission.DiskBudget(headroom=100, poll_interval=0.05,
+                                disk_usage=lambda path: FakeUsage(1100))
+
+
+# Tests
+class TestDiskBudget:
+
+    def test_available_excludes_headroom_and_reservations(self, tmpdir, budget):
+        assert budget.available(str(tmpdir)) == 1000
+        with budget.reserve(str(tmpdir), 300, 'job'):
+            assert budget.available(str(tmpdir)) == 700
+        assert budget.available(str(tmpdir)) == 1000
+
+    def test_job_that_never_fits_is_rejected(self, tmpdir, budget):
+        with pytest.raises(admission.InsufficientSpaceError) as e:
+            budget.acquire(str(tmpdir), 2000, 'VID_1')
+        assert 'VID_1' in str(e.value)
+
+    def test_job_is_deferred_until_space_is_released(self, tmpdir, budget):
+        first = budget.acquire(str(tmpdir), 800, 'first')
+        admitted = threading.Event()
+        def second():
+            with budget.reserve(str(tmpdir), 800, 'second'):
+                admitted.set()
+        thread = threading.Thread(target=second)
+        thread.start()
+        assert not admitted.wait(0.2)
+        budget.release(first)
+        assert admitted.wait(5)
+        thread.join()
+
+    def test_cancelled_while_deferred(self, tmpdir, budget):
+        budget.acquire(str(tmpdir), 800, 'first')
+        cancel_event = threading.Event()
+        errors = []
+        def second():
+            try:
+                budget.acquire(str(tmpdir), 800, 'second', cancel_event=cancel_event)
+            except admission.AdmissionCancelled as e:
+                errors.append(e)
+        thread = threading.Thread(target=second)
+        thread.start()
+        cancel_event.set()
+        thread.join(5)
+        assert not thread.is_alive()
+        assert len(errors) == 1
+        # The cancelled job holds no space
+        assert budget.available(str(tmpdir)) == 200
+
+    def test_consumed_and_watched_bytes_are_not_reserved(self, tmpdir, budget):
+        output = tmpdir.join('VID_1.mp4')
+        output.write_binary(b'\0' * 200)
+        with budget.reserve(str(tmpdir), 500, 'stitch', watch_paths=[str(output)]):
+            assert budget.available(str(tmpdir)) == 700
+        # Missing files count as nothing written
+        part = str(tmpdir.join('.VID_1.mp4.part'))
+        with budget.reserve(str(tmpdir), 500, 'finish', watch_paths=[str(output), part]):
+            assert budget.available(str(tmpdir)) == 700
+        with budget.reserve(str(tmpdir), 500, 'copy') as reservation:
+            reservation.consume(450)
+            assert budget.available(str(tmpdir)) == 950
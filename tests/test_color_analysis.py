@@ -0,0 +1,104 @@
+"""Tests of exposure analysis and color suggestions."""
+
+import numpy as np
+import pytest
+
+from flugelhorn import color_analysis, config_builder
+from flugelhorn.config_builder import StitchSource
+from flugelhorn.stitcher_settings import build_config_template, initialize_settings
+
+
+def frame(rgb, shape=(8, 16)):
+    return np.tile(np.array(rgb, np.uint8), shape + (1,))
+
+
+def stats_for(*frames):
+    accumulator = color_analysis.ExposureAccumulator()
+    for f in frames:
+        accumulator.add(f)
+    return accumulator.stats()
+
+
+# Tests
+class TestExposureAccumulator:
+
+    def test_gray_frames(self):
+        stats = stats_for(frame((0, 0, 0)), frame((255, 255, 255)))
+        assert stats.mean_luma == pytest.approx(0.5, abs=0.01)
+        assert stats.low_luma < 0.01
+        assert stats.high_luma > 0.99
+        assert stats.mean_rgb == pytest.approx((0.5, 0.5, 0.5))
+        assert stats.mean_saturation == 0
+
+    def test_saturated_frame(self):
+        stats = stats_for(frame((255, 0, 0)))
+        assert stats.mean_saturation == pytest.approx(1.0)
+        assert stats.mean_luma == pytest.approx(0.2126, abs=0.01)
+
+    def test_no_frames(self):
+        with pytest.raises(ValueError):
+            color_analysis.ExposureAccumulator().stats()
+
+
+class TestSuggestColorSettings:
+
+    def test_dark_blue_scene(self):
+        suggestions = color_analysis.suggest_color_settings(
+            stats_for(frame((0, 0, 0)), frame((20, 30, 60)), frame((30, 40, 80))))
+        assert suggestions['brightness'] > 0
+        assert suggestions['tempture'] > 0
+        assert suggestions['shadow'] > 0
+        assert suggestions['highlight'] == 0
+
+    def test_suggestions_are_clamped(self):
+        suggestions = color_analysis.suggest_color_settings(stats_for(frame((0, 0, 0))))
+        low, high = color_analysis.COLOR_RANGE
+        assert all(low <= value <= high for value in suggestions.values())
+        assert set(suggestions) == set(color_analysis.AUTO_COLOR_SETTINGS)
+
+    def test_apply_keeps_user_settings(self):
+        config = initialize_settings(build_config_template())
+        config.color.brightness = 10
+        config.color.contrast = 0
+        color_analysis.apply_color_suggestions(config.color, {'brightness': 40, 'contrast': 5})
+        assert config.color.brightness == 10
+        assert config.color.contrast == 5
+
+    def test_unset_settings(self):
+        config = initialize_settings(build_config_template())
+        for key in color_analysis.AUTO_COLOR_SETTINGS:
+            setattr(config.color, key, 1)
+        assert color_analysis.unset_color_settings(config.color) == []
+        config.color.tint = 0
+        assert color_analysis.unset_color_settings(config.color) == ['tint']
+
+
+class TestAutoColorConfig:
+
+    @pytest.fixture
+    def config(self, monkeypatch):
+        proj = {'gyro_version': '3', 'timeOffset': '0', 'gravity_x': '0',
+                'gravity_y': '0', 'gravity_z': '1'}
+        monkeypatch.setattr(config_builder, 'parse_proj_xml', lambda path: proj)
+        config = initialize_settings(build_config_template())
+        config.color.brightness = 10
+        return config
+
+    def test_failed_keyframe_keeps_color_settings(self, config, monkeypatch):
+        def broken(*args):
+            raise color_analysis.KeyframeError('broken')
+        monkeypatch.setattr(color_analysis, 'extract_keyframe', broken)
+        group = {n: 'origin_{0}.mp4'.format(n) for n in range(6)}
+        group.update(start=0, end=10.0, size=(3840, 2880))
+        source = StitchSource([group], 'pro.prj', 'gyro.dat')
+        color = repr(config.color)
+        config = config_builder.build_stitching_config(config, source, 'VID_1',
+                                                       auto_color=True)
+        assert repr(config.color) == color
+
+    def test_no_videos_keeps_color_settings(self, config):
+        source = StitchSource([], 'pro.prj', 'gyro.dat')
+        color = repr(config.color)
+        config = config_builder.build_stitching_config(config, source, 'VID_1',
+                                                       auto_color=True)
+        assert repr(config.color) == color
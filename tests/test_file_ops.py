@@ -0,0 +1,27 @@
+"""Tests of file operations."""
+
+import os
+
+from flugelhorn import file_ops
+
+
+# Tests
+class TestCopySourceToRawDirs:
+
+    def test_copy_replaces_stale_partial_copy(self, tmpdir):
+        source = tmpdir.mkdir('card').mkdir('VID_1')
+        source.join('origin_0.mp4').write_binary(b'\0' * 16)
+        raw_dir = tmpdir.mkdir('raw')
+        stale = raw_dir.mkdir('.VID_1.part')
+        stale.join('origin_5.mp4').write_binary(b'\0' * 4)
+
+        dest_paths = file_ops.copy_source_to_raw_dirs([str(source)], str(raw_dir))
+        assert dest_paths == [os.path.join(str(raw_dir), 'VID_1')]
+        assert os.listdir(str(raw_dir)) == ['VID_1']
+        assert os.listdir(dest_paths[0]) == ['origin_0.mp4']
+
+    def test_partial_copies_are_not_found(self, tmpdir):
+        tmpdir.mkdir('VID_1')
+        tmpdir.mkdir('.VID_2.part')
+        video_dirs, _ = file_ops.find_video_image_dirs(str(tmpdir))
+        assert video_dirs == [os.path.join(str(tmpdir), 'VID_1')]
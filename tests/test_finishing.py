@@ -0,0 +1,168 @@
+"""Tests of post-stitch 360 metadata injection."""
+
+import shutil
+import struct
+
+import pytest
+from flugelhorn import finishing
+from flugelhorn.finishing import Box
+
+
+VIDEO_DATA = b'video-sample'
+AUDIO_DATA = b'audio-sample'
+
+
+def make_track(handler, sample_entry, chunk_offset):
+    hdlr = Box(b'hdlr', b'\0' * 8 + handler + b'\0' * 12)
+    stsd = Box(b'stsd', struct.pack('>II', 0, 1), [sample_entry])
+    stco = Box(b'stco', struct.pack('>III', 0, 1, chunk_offset))
+    stbl = Box(b'stbl', children=[stsd, stco])
+    mdia = Box(b'mdia', children=[hdlr, Box(b'minf', children=[stbl])])
+    return Box(b'trak', children=[Box(b'tkhd', b'\0' * 84), mdia])
+
+
+def mp4a_entry(channels):
+    fixed = b'\0' * 6 + struct.pack('>H', 1) + b'\0' * 8
+    fixed += struct.pack('>HHHHI', channels, 16, 0, 0, 48000 << 16)
+    return Box(b'mp4a', fixed, [Box(b'esds', b'\0' * 20)])
+
+
+def write_mp4(path, channels=4):
+    """Write a minimal faststart mp4, with moov before mdat."""
+    ftyp = Box(b'ftyp', b'isom\0\0\2\0isomiso2mp41')
+
+    def build(video_offset, audio_offset):
+        return Box(b'moov', children=[
+            Box(b'mvhd', b'\0' * 100),
+            make_track(b'vide', Box(b'mp4v', b'\0' * 78), video_offset),
+            make_track(b'soun', mp4a_entry(channels), audio_offset)])
+
+    # Offsets depend on the moov size, which doesn't depend on offset values
+    data_start = len(ftyp.to_bytes()) + len(build(0, 0).to_bytes()) + 8
+    moov = build(data_start, data_start + len(VIDEO_DATA))
+    mdat = Box(b'mdat', VIDEO_DATA + AUDIO_DATA)
+    with open(path, 'wb') as f:
+        f.write(ftyp.to_bytes() + moov.to_bytes() + mdat.to_bytes())
+
+
+def read_moov(path):
+    with open(path, 'rb') as f:
+        for box_type, offset, size, header in finishing._read_top_level_boxes(f):
+            if box_type == b'moov':
+                f.seek(offset + header)
+                return Box(b'moov', children=finishing._parse_boxes(f.read(size - header)))
+
+
+def tracks(moov):
+    return {finishing._track_handler(t): t for t in moov.children if t.type == b'trak'}
+
+
+def chunk_offset(trak):
+    stco = finishing._sample_table(trak).find(b'stco')
+    return struct.unpack_from('>I', stco.payload, 8)[0]
+
+
+# Fixtures
+@pytest.fixture
+def src(tmpdir):
+    path = str(tmpdir.join('VID_1.mp4'))
+    write_mp4(path)
+    return path
+
+
+# Tests
+class TestInjectSphericalMetadata:
+
+    def test_adds_spherical_video(self, tmpdir, src):
+        dst = str(tmpdir.join('out.mp4'))
+        finishing.inject_spherical_metadata(src, dst, 'top-bottom')
+        uuid = tracks(read_moov(dst))[b'vide'].find(b'uuid')
+        assert uuid.payload.startswith(finishing.SPHERICAL_UUID)
+        xml = uuid.payload[16:].decode('utf-8')
+        assert '<GSpherical:Spherical>true</GSpherical:Spherical>' in xml
+        assert '<GSpherical:StereoMode>top-bottom</GSpherical:StereoMode>' in xml
+
+    def test_adds_spatial_audio(self, tmpdir, src):
+        dst = str(tmpdir.join('out.mp4'))
+        finishing.inject_spherical_metadata(src, dst)
+        stsd = finishing._sample_table(tracks(read_moov(dst))[b'soun']).find(b'stsd')
+        sa3d = stsd.children[0].find(b'SA3D')
+        assert sa3d.payload == struct.pack('>BBIBBI4I', 0, 0, 1, 0, 0, 4, 0, 1, 2, 3)
+
+    def test_stereo_audio_is_not_spatial(self, tmpdir):
+        src = str(tmpdir.join('stereo.mp4'))
+        dst = str(tmpdir.join('out.mp4'))
+        write_mp4(src, channels=2)
+        finishing.inject_spherical_metadata(src, dst)
+        stsd = finishing._sample_table(tracks(read_moov(dst))[b'soun']).find(b'stsd')
+        assert stsd.children[0].find(b'SA3D') is None
+
+    def test_chunk_offsets_follow_media_data(self, tmpdir, src):
+        dst = str(tmpdir.join('out.mp4'))
+        finishing.inject_spherical_metadata(src, dst)
+        moov = tracks(read_moov(dst))
+        with open(dst, 'rb') as f:
+            data = f.read()
+        video_offset = chunk_offset(moov[b'vide'])
+        audio_offset = chunk_offset(moov[b'soun'])
+        assert data[video_offset:video_offset + len(VIDEO_DATA)] == VIDEO_DATA
+        assert data[audio_offset:audio_offset + len(AUDIO_DATA)] == AUDIO_DATA
+
+    def test_injection_is_idempotent(self, tmpdir, src):
+        once = str(tmpdir.join('once.mp4'))
+        twice = str(tmpdir.join('twice.mp4'))
+        finishing.inject_spherical_metadata(src, once)
+        finishing.inject_spherical_metadata(once, twice)
+        with open(once, 'rb') as f1, open(twice, 'rb') as f2:
+            assert f1.read() == f2.read()
+
+    def test_overflowing_chunk_offsets_are_promoted(self):
+        trak = make_track(b'vide', Box(b'mp4v', b'\0' * 78), 0xffffff00)
+        moov = Box(b'moov', children=[trak])
+        assert finishing._promote_chunk_offsets(moov, 0x200)
+        finishing._shift_chunk_offsets(moov, 0x200)
+        co64 = finishing._sample_table(trak).find(b'co64')
+        assert struct.unpack_from('>Q', co64.payload, 8)[0] == 0xffffff00 + 0x200
+        assert not finishing._promote_chunk_offsets(moov, 0x200)
+
+
+class TestFinisher:
+
+    def test_finishes_hidden_video_into_place(self, tmpdir, monkeypatch):
+        hidden = str(tmpdir.join('.VID_1.mp4'))
+        dest = str(tmpdir.join('VID_1.mp4'))
+        # The test file is already faststart
+        monkeypatch.setattr(finishing, 'faststart_remux', shutil.copyfile)
+        write_mp4(hidden)
+        finisher = finishing.Finisher()
+        finisher.submit(hidden, dest)
+        assert finisher.wait() == []
+        assert not tmpdir.join('.VID_1.mp4').exists()
+        assert tracks(read_moov(dest))[b'vide'].find(b'uuid') is not None
+
+    def test_failed_finish_moves_unfinished_video_into_place(self, tmpdir):
+        hidden = tmpdir.join('.VID_1.mp4')
+        hidden.write_binary(b'not an mp4')
+        dest = str(tmpdir.join('VID_1.mp4'))
+        finisher = finishing.Finisher()
+        finisher.submit(str(hidden), dest)
+        assert finisher.wait() == [dest]
+        assert not hidden.exists()
+        assert open(dest, 'rb').read() == b'not an mp4'
+        assert [p.basename for p in tmpdir.listdir()] == ['VID_1.mp4']
+
+    def test_unsupported_stereo_layout_has_no_spherical_video(self, tmpdir, monkeypatch):
+        settings = tmpdir.join('stereo.yaml')
+        settings.write('blend:\n  mode: stereo_separate\n')
+        finisher = finishing.build_finisher(str(settings))
+        finisher.wait()
+        assert not finisher.spherical_video
+
+        video = str(tmpdir.join('VID_1.mp4'))
+        write_mp4(video)
+        monkeypatch.setattr(finishing, 'faststart_remux', shutil.copyfile)
+        finishing.finish_stitched_video(video, spherical_video=False)
+        moov = tracks(read_moov(video))
+        assert moov[b'vide'].find(b'uuid') is None
+        stsd = finishing._sample_table(moov[b'soun']).find(b'stsd')
+        assert stsd.children[0].find(b'SA3D') is not None
@@ -0,0 +1,167 @@
+"""Tests of multi-card ingest."""
+
+from collections import namedtuple
+import os
+import threading
+
+import pytest
+from flugelhorn import admission, ingest
+
+
+FakeUsage = namedtuple('FakeUsage', 'free')
+
+
+def make_recording(card, name, num_files=3):
+    path = card.mkdir(name)
+    for n in range(num_files):
+        path.join('origin_{0}.mp4'.format(n)).write_binary(os.urandom(1024))
+    path.join('pro.prj').write('<project/>')
+    return str(path)
+
+
+# Fixtures
+@pytest.fixture
+def cards(tmpdir):
+    card_a = tmpdir.mkdir('card_a')
+    card_b = tmpdir.mkdir('card_b')
+    make_recording(card_a, 'VID_1')
+    make_recording(card_a, 'VID_2')
+    make_recording(card_b, 'VID_3')
+    return [str(card_a), str(card_b)]
+
+
+@pytest.fixture
+def raw_dir(tmpdir):
+    return str(tmpdir.mkdir('raw'))
+
+
+# Tests
+class TestIngestSources:
+
+    def test_copies_all_cards(self, cards, raw_dir):
+        copied = []
+        video_paths, image_paths = ingest.ingest_sources(
+            cards, raw_dir, files_per_device=2, max_writers=1, on_copied=copied.append)
+        expected = sorted(os.path.join(raw_dir, name) for name in ['VID_1', 'VID_2', 'VID_3'])
+        assert sorted(video_paths) == expected
+        assert sorted(copied) == expected
+        assert image_paths == []
+        for name in ['VID_1', 'VID_3']:
+            assert sorted(os.listdir(os.path.join(raw_dir, name))) == [
+                'origin_0.mp4', 'origin_1.mp4', 'origin_2.mp4', 'pro.prj']
+
+    def test_skips_name_collisions(self, tmpdir, cards, raw_dir):
+        make_recording(tmpdir.join('card_b'), 'VID_1', num_files=1)
+        video_paths, _ = ingest.ingest_sources(cards, raw_dir)
+        assert len(video_paths) == 3
+        # The first card's recording is kept
+        assert len(os.listdir(os.path.join(raw_dir, 'VID_1'))) == 4
+
+    def test_skips_existing_raw_dirs(self, cards, raw_dir):
+        os.makedirs(os.path.join(raw_dir, 'VID_2'))
+        video_paths, _ = ingest.ingest_sources(cards, raw_dir)
+        assert os.path.join(raw_dir, 'VID_2') not in video_paths
+        assert len(video_paths) == 2
+
+    def test_failed_copy_is_removed_and_retried(self, cards, raw_dir, monkeypatch):
+        copy2 = ingest.shutil.copy2
+        def failing_copy2(src, dst):
+            if src.endswith(os.path.join('VID_1', 'origin_1.mp4')):
+                raise OSError('card removed')
+            copy2(src, dst)
+        monkeypatch.setattr(ingest.shutil, 'copy2', failing_copy2)
+        video_paths, _ = ingest.ingest_sources(cards, raw_dir)
+        assert sorted(os.listdir(raw_dir)) == ['VID_2', 'VID_3']
+
+        monkeypatch.setattr(ingest.shutil, 'copy2', copy2)
+        video_paths, _ = ingest.ingest_sources(cards, raw_dir)
+        assert video_paths == [os.path.join(raw_dir, 'VID_1')]
+        assert len(os.listdir(video_paths[0])) == 4
+
+    def test_replaces_partial_copy(self, cards, raw_dir):
+        os.makedirs(os.path.join(raw_dir, '.VID_1.part', 'stale'))
+        ingest.ingest_sources(cards, raw_dir)
+        assert sorted(os.listdir(raw_dir)) == ['VID_1', 'VID_2', 'VID_3']
+        assert 'stale' not in os.listdir(os.path.join(raw_dir, 'VID_1'))
+
+    def test_skips_recordings_without_space(self, cards, raw_dir):
+        budget = admission.DiskBudget(headroom=0, disk_usage=lambda path: FakeUsage(100))
+        video_paths, _ = ingest.ingest_sources(cards, raw_dir, disk_budget=budget)
+        assert video_paths == []
+        # Nothing is left half copied
+        assert os.listdir(raw_dir) == []
+
+    def test_defers_recordings_until_space_is_free(self, cards, raw_dir):
+        # Room for one recording at a time
+        budget = admission.DiskBudget(headroom=0, poll_interval=0.1,
+                                      disk_usage=lambda path: FakeUsage(4000))
+        video_paths, _ = ingest.ingest_sources(cards, raw_dir, disk_budget=budget)
+        assert len(video_paths) == 3
+        assert budget.available(raw_dir) == 4000
+
+
+    def test_deferred_recording_does_not_stall_other_cards(self, tmpdir, raw_dir,
+                                                           monkeypatch):
+        card_a = tmpdir.mkdir('card_a')
+        card_b = tmpdir.mkdir('card_b')
+        make_recording(card_a, 'VID_1')
+        make_recording(card_b, 'VID_2', num_files=1)
+        # Treat the two cards as separate devices
+        plan = ingest._plan_recordings
+        def plan_by_card(*args):
+            recordings, existing_paths = plan(*args)
+            for recording in recordings:
+                recording.device = os.path.basename(os.path.dirname(recording.source_path))
+            return recordings, existing_paths
+        monkeypatch.setattr(ingest, '_plan_recordings', plan_by_card)
+
+        budget = admission.DiskBudget(headroom=0, poll_interval=0.05,
+                                      disk_usage=lambda path: FakeUsage(5000))
+        # Another job leaves room for VID_2, but not VID_1, until it finishes
+        other_job = budget.acquire(raw_dir, 3000, 'other job')
+        copied = []
+        def on_copied(path):
+            copied.append(os.path.basename(path))
+            budget.release(other_job)
+        ingest.ingest_sources([str(card_a), str(card_b)], raw_dir, on_copied=on_copied,
+                              disk_budget=budget)
+        assert copied == ['VID_2', 'VID_1']
+
+    def test_progress_reported_while_deferred(self, cards, raw_dir, capsys):
+        budget = admission.DiskBudget(headroom=0, poll_interval=0.05,
+                                      disk_usage=lambda path: FakeUsage(5000))
+        other_job = budget.acquire(raw_dir, 4000, 'other job')
+        timer = threading.Timer(0.5, budget.release, [other_job])
+        timer.start()
+        video_paths, _ = ingest.ingest_sources(cards, raw_dir, report_interval=0.1,
+                                               disk_budget=budget)
+        timer.join()
+        assert len(video_paths) == 3
+        out = capsys.readouterr().out
+        # Card progress is reported before the deferred recording is admitted
+        assert out.index('{0}: '.format(cards[0])) < out.index('Admitted')
+
+
+class TestCardProgress:
+
+    def test_progress_report(self):
+        progress = ingest.CardProgress('/Volumes/CARD_A')
+        progress.add_file(2000000)
+        progress.add_file(2000000)
+        progress.file_copied(2000000)
+        assert '1/2 files' in repr(progress)
+        assert '(50%)' in repr(progress)
+
+    def test_throughput_includes_first_file(self, monkeypatch):
+        now = [100.0]
+        monkeypatch.setattr(ingest.time, 'time', lambda: now[0])
+        progress = ingest.CardProgress('/Volumes/CARD_A')
+        progress.add_file(4000000)
+        progress.add_file(4000000)
+        progress.file_started()
+        now[0] = 100.5
+        progress.file_copied(4000000)
+        assert progress.throughput == 8000000
+        now[0] = 101.0
+        progress.file_copied(4000000)
+        assert progress.throughput == 8000000
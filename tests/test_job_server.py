@@ -0,0 +1,192 @@
+"""Tests of the stitching job queue and HTTP server, using a fake stitcher."""
+
+import json
+import os
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+from flugelhorn import job_server
+
+
+class FakeStitcher:
+    """Records stitched dirs, and blocks each stitch until released."""
+    def __init__(self):
+        self.stitched = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, raw_video_dir, stitched_dir, settings_yaml, cancel_event=None):
+        self.started.set()
+        while not self.release.wait(0.01):
+            if cancel_event.is_set():
+                return
+        if os.path.basename(raw_video_dir) == 'broken':
+            raise ValueError('bad recording')
+        self.stitched.append(os.path.basename(raw_video_dir))
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+# Fixtures
+@pytest.fixture
+def dirs(tmpdir):
+    paths = {}
+    for name in ['stitched', 'settings', 'VID_1', 'VID_2', 'VID_3', 'broken']:
+        paths[name] = str(tmpdir.mkdir(name))
+    with open(os.path.join(paths['settings'], 'daily_mono.yaml'), 'w') as f:
+        f.write('input:\n  type: video\n')
+    return paths
+
+
+@pytest.fixture
+def stitcher():
+    return FakeStitcher()
+
+
+@pytest.fixture
+def job_queue(dirs, stitcher):
+    jobs = job_server.JobQueue(stitcher, dirs['stitched'], dirs['settings'],
+                               workers=1, max_queued=2)
+    yield jobs
+    stitcher.release.set()
+    jobs.stop()
+
+
+# Tests
+class TestJobQueue:
+
+    def test_jobs_run_by_priority(self, dirs, stitcher, job_queue):
+        job_queue.submit(dirs['VID_1'], 'daily_mono', priority=5)
+        job_queue.submit(dirs['VID_2'], 'daily_mono', priority=1)
+        stitcher.release.set()
+        job_queue.start()
+        wait_for(lambda: all(j.state == job_server.DONE for j in job_queue.jobs()))
+        assert stitcher.stitched == ['VID_2', 'VID_1']
+
+    def test_queue_is_bounded(self, dirs, job_queue):
+        job_queue.submit(dirs['VID_1'], 'daily_mono')
+        job_queue.submit(dirs['VID_2'], 'daily_mono')
+        with pytest.raises(job_server.QueueFullError):
+            job_queue.submit(dirs['VID_3'], 'daily_mono')
+
+    def test_cancelled_jobs_free_queue_slots(self, dirs, job_queue):
+        job = job_queue.submit(dirs['VID_1'], 'daily_mono')
+        job_queue.submit(dirs['VID_2'], 'daily_mono')
+        job_queue.cancel(job.id)
+        job_queue.submit(dirs['VID_3'], 'daily_mono')
+
+    def test_duplicate_outputs_rejected(self, tmpdir, dirs, job_queue):
+        job = job_queue.submit(dirs['VID_1'], 'daily_mono')
+        # Same raw dir, or another raw dir with the same name
+        with pytest.raises(job_server.DuplicateJobError):
+            job_queue.submit(dirs['VID_1'], 'daily_mono')
+        with pytest.raises(job_server.DuplicateJobError):
+            job_queue.submit(str(tmpdir.mkdir('card').mkdir('VID_1')), 'daily_mono')
+        job_queue.cancel(job.id)
+        job_queue.submit(dirs['VID_1'], 'daily_mono')
+
+    def test_invalid_submissions(self, dirs, job_queue):
+        with pytest.raises(job_server.JobError):
+            job_queue.submit(os.path.join(dirs['VID_1'], 'missing'), 'daily_mono')
+        with pytest.raises(job_server.JobError):
+            job_queue.submit(dirs['VID_1'], 'no_such_profile')
+        with pytest.raises(job_server.JobError):
+            job_queue.submit(dirs['VID_1'], '../settings/daily_mono')
+        with pytest.raises(job_server.JobError):
+            job_queue.submit([dirs['VID_1']], 'daily_mono')
+        with pytest.raises(job_server.JobError):
+            job_queue.submit(dirs['VID_1'], 5)
+
+    def test_cancel_queued_job(self, dirs, stitcher, job_queue):
+        job = job_queue.submit(dirs['VID_1'], 'daily_mono')
+        job_queue.cancel(job.id)
+        stitcher.release.set()
+        job_queue.start()
+        assert job.state == job_server.CANCELLED
+        assert stitcher.stitched == []
+
+    def test_cancel_running_job(self, dirs, stitcher, job_queue):
+        job_queue.start()
+        job = job_queue.submit(dirs['VID_1'], 'daily_mono')
+        assert stitcher.started.wait(5)
+        job_queue.cancel(job.id)
+        wait_for(lambda: job.state == job_server.CANCELLED)
+
+    def test_failed_job(self, dirs, stitcher, job_queue):
+        stitcher.release.set()
+        job_queue.start()
+        job = job_queue.submit(dirs['broken'], 'daily_mono')
+        wait_for(lambda: job.state == job_server.FAILED)
+        assert 'bad recording' in job.error
+
+
+class TestJobServer:
+
+    @pytest.fixture
+    def base_url(self, job_queue):
+        server = job_server.JobServer(('127.0.0.1', 0), job_queue)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield 'http://127.0.0.1:{0}'.format(server.server_address[1])
+        server.shutdown()
+        server.server_close()
+
+    def request(self, url, method='GET', body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        try:
+            with urlopen(Request(url, data=data, method=method)) as response:
+                return response.status, json.loads(response.read().decode('utf-8'))
+        except HTTPError as e:
+            return e.code, json.loads(e.read().decode('utf-8'))
+
+    def test_submit_and_status(self, dirs, stitcher, job_queue, base_url):
+        job_queue.start()
+        status, job = self.request(base_url + '/jobs', 'POST',
+                                   {'raw': dirs['VID_1'], 'settings': 'daily_mono'})
+        assert status == 201
+        stitcher.release.set()
+        job_url = '{0}/jobs/{1}'.format(base_url, job['id'])
+        wait_for(lambda: self.request(job_url)[1]['state'] == job_server.DONE)
+
+        status, listing = self.request(base_url + '/jobs')
+        assert status == 200
+        assert [j['id'] for j in listing['jobs']] == [job['id']]
+
+    def test_log_excerpt(self, dirs, stitcher, job_queue, base_url):
+        job = job_queue.submit(dirs['VID_1'], 'daily_mono')
+        with open(job.log_path, 'w') as f:
+            f.write(''.join('line {0}\n'.format(n) for n in range(100)))
+        status, body = self.request('{0}/jobs/{1}'.format(base_url, job.id))
+        assert status == 200
+        assert body['log'][-1] == 'line 99'
+        assert len(body['log']) == job_server.LOG_EXCERPT_LINES
+
+    def test_cancel(self, dirs, job_queue, base_url):
+        job = job_queue.submit(dirs['VID_1'], 'daily_mono')
+        status, body = self.request('{0}/jobs/{1}'.format(base_url, job.id), 'DELETE')
+        assert status == 200
+        assert body['state'] == job_server.CANCELLED
+
+    def test_errors(self, dirs, job_queue, base_url):
+        assert self.request(base_url + '/jobs/42')[0] == 404
+        assert self.request(base_url + '/jobs', 'POST', {'raw': dirs['VID_1']})[0] == 400
+        assert self.request(base_url + '/jobs', 'POST',
+                            {'raw': ['x'], 'settings': 'daily_mono'})[0] == 400
+        assert self.request(base_url + '/jobs', 'POST',
+                            {'raw': dirs['VID_1'], 'settings': 5})[0] == 400
+        for name in ['VID_1', 'VID_2']:
+            job_queue.submit(dirs[name], 'daily_mono')
+        status, _ = self.request(base_url + '/jobs', 'POST',
+                                 {'raw': dirs['VID_3'], 'settings': 'daily_mono'})
+        assert status == 503
+        status, _ = self.request(base_url + '/jobs', 'POST',
+                                 {'raw': dirs['VID_1'], 'settings': 'daily_mono'})
+        assert status == 409
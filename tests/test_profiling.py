@@ -0,0 +1,37 @@
+"""Tests of pipeline stage profiling."""
+
+import os
+
+from flugelhorn import profiling
+
+
+def allocate():
+    return [bytearray(1024) for _ in range(100)]
+
+
+# Tests
+class TestStageProfiler:
+
+    def test_disabled_profiler_writes_nothing(self, tmpdir):
+        profiler = profiling.StageProfiler(str(tmpdir))
+        with profiler.stage('config'):
+            allocate()
+        assert not profiler.enabled
+        assert profiler.stages == []
+        assert not os.path.exists(os.path.join(str(tmpdir), profiling.PROFILE_DIRNAME))
+
+    def test_stage_reports(self, tmpdir):
+        profiler = profiling.StageProfiler(str(tmpdir), profile=True, trace_malloc=True,
+                                           top_n=5)
+        with profiler.stage('VID_1.config'):
+            held = allocate()
+        report_dir = os.path.join(str(tmpdir), profiling.PROFILE_DIRNAME)
+        assert os.path.isfile(os.path.join(report_dir, 'VID_1.config.pstats'))
+        assert os.path.isfile(os.path.join(report_dir, 'VID_1.config.malloc.txt'))
+        name, elapsed, peak = profiler.stages[0]
+        assert name == 'VID_1.config'
+        assert peak >= 100 * 1024
+
+        summary = profiler.summary()
+        assert 'VID_1.config' in summary
+        assert 'allocate' in summary
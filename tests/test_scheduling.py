@@ -0,0 +1,110 @@
+"""Tests of stitch scheduling and throughput history."""
+
+import datetime
+import os
+
+import pytest
+from flugelhorn import scheduling
+
+
+# Fixtures
+@pytest.fixture
+def history_path(tmpdir):
+    return str(tmpdir.join('history', 'throughput.json'))
+
+
+@pytest.fixture
+def durations():
+    return {'/raw/VID_long': 7200.0, '/raw/VID_short': 30.0,
+            '/raw/VID_mid': 600.0, '/raw/VID_broken': None}
+
+
+@pytest.fixture
+def raw_dirs():
+    return ['/raw/VID_long', '/raw/VID_broken', '/raw/VID_short', '/raw/VID_mid']
+
+
+# Tests
+class TestThroughputHistory:
+
+    def test_no_history(self, history_path):
+        history = scheduling.ThroughputHistory(history_path)
+        assert history.estimate('daily_mono@3840x1920') is None
+
+    def test_record_and_reload(self, history_path):
+        history = scheduling.ThroughputHistory(history_path)
+        for output_seconds in [100, 200, 300]:
+            history.record('daily_mono@3840x1920', output_seconds, 400)
+        history.save()
+        reloaded = scheduling.ThroughputHistory(history_path)
+        assert reloaded.estimate('daily_mono@3840x1920') == 0.5
+        assert reloaded.estimate('hq_stereo@6400x6400') is None
+
+    def test_keeps_recent_samples(self, history_path):
+        history = scheduling.ThroughputHistory(history_path)
+        for _ in range(scheduling.MAX_SAMPLES):
+            history.record('key', 1, 100)
+        for _ in range(scheduling.MAX_SAMPLES):
+            history.record('key', 1, 1)
+        assert history.estimate('key') == 1
+
+
+class TestPlanJobs:
+
+    def test_scan_order(self, raw_dirs, durations):
+        jobs = scheduling.plan_jobs(raw_dirs, durations, order='scan')
+        assert [job.raw_dir for job in jobs] == raw_dirs
+
+    def test_shortest_first(self, raw_dirs, durations):
+        jobs = scheduling.plan_jobs(raw_dirs, durations, throughput=0.5)
+        assert [job.raw_dir for job in jobs] == [
+            '/raw/VID_short', '/raw/VID_mid', '/raw/VID_long', '/raw/VID_broken']
+        assert jobs[0].runtime == 60.0
+        assert jobs[-1].runtime is None
+
+    def test_deadline_first(self, raw_dirs, durations):
+        deadlines = scheduling.parse_deadlines(['VID_long=2018-07-14T09:00',
+                                                'VID_mid=2018-07-14T12:00'])
+        jobs = scheduling.plan_jobs(raw_dirs, durations, order='deadline',
+                                    deadlines=deadlines)
+        assert [job.raw_dir for job in jobs] == [
+            '/raw/VID_long', '/raw/VID_mid', '/raw/VID_short', '/raw/VID_broken']
+        assert jobs[0].deadline == datetime.datetime(2018, 7, 14, 9, 0)
+
+    def test_invalid_deadline(self):
+        with pytest.raises(ValueError):
+            scheduling.parse_deadlines(['VID_long 2018-07-14'])
+
+
+class TestFormatBatchEta:
+
+    def test_batch_eta(self, durations):
+        jobs = scheduling.plan_jobs(['/raw/VID_short', '/raw/VID_mid'], durations,
+                                    throughput=1.0)
+        start = datetime.datetime(2018, 7, 14, 9, 0).timestamp()
+        report = scheduling.format_batch_eta(jobs, start=start)
+        assert 'VID_short: 30s of video, finishes 2018-07-14 09:00' in report
+        assert 'Batch ETA: 2018-07-14 09:10 (10 minutes).' in report
+
+    def test_late_jobs_flagged(self, durations):
+        deadlines = {'VID_mid': datetime.datetime(2018, 7, 14, 9, 5)}
+        jobs = scheduling.plan_jobs(['/raw/VID_mid'], durations, throughput=1.0,
+                                    deadlines=deadlines)
+        start = datetime.datetime(2018, 7, 14, 9, 0).timestamp()
+        assert '(LATE)' in scheduling.format_batch_eta(jobs, start=start)
+
+    def test_unknown_eta(self, raw_dirs, durations):
+        jobs = scheduling.plan_jobs(raw_dirs, durations)
+        report = scheduling.format_batch_eta(jobs, 'daily_mono@3840x1920')
+        assert 'No throughput history for daily_mono@3840x1920' in report
+
+
+class TestWrittenSince:
+
+    def test_old_and_missing_outputs(self, tmpdir):
+        path = tmpdir.join('VID_1.mp4')
+        assert not scheduling.written_since(str(path), 1000)
+        path.write_binary(b'\0')
+        os.utime(str(path), (1000, 1000))
+        assert scheduling.written_since(str(path), 1000.5)
+        assert not scheduling.written_since(str(path), 1001)
@@ -1,9 +1,16 @@
 """Tests of Stitching functions."""
 
+from collections import namedtuple
 import platform
+import threading
+import time
 
 import pytest
-from flugelhorn import stitching
+from flugelhorn import admission, stitching
+
+
+FakeUsage = namedtuple('FakeUsage', 'free')
+
 
 # Fixtures
 @pytest.fixture
@@ -43,3 +50,69 @@ class TestStitcherAppPath:
             with pytest.raises(stitching.StitcherInstallError):
                 get_stitching_app_path() 
 
+
+
+class TestRunStitchingApp:
+
+    @pytest.fixture
+    def fake_app(self, tmpdir, monkeypatch):
+        if platform.system() == 'Windows':
+            pytest.skip('Fake stitching app is a shell script')
+        def make_app(exit_code):
+            app_path = tmpdir.join('ProStitcher')
+            app_path.write('#!/bin/sh\nexit {0}\n'.format(exit_code))
+            app_path.chmod(0o755)
+            monkeypatch.setattr(stitching, 'get_stitching_app_path', lambda: str(app_path))
+        return make_app
+
+    def test_success(self, tmpdir, fake_app):
+        fake_app(0)
+        stitching.run_stitching_app(str(tmpdir.join('a.xml')), str(tmpdir.join('a.log')))
+
+    def test_failure_raises(self, tmpdir, fake_app):
+        fake_app(3)
+        with pytest.raises(stitching.StitchingError) as e:
+            stitching.run_stitching_app(str(tmpdir.join('a.xml')), str(tmpdir.join('a.log')))
+        assert 'code 3' in str(e.value)
+
+
+class TestStitchFromRaw:
+
+    @pytest.fixture
+    def fake_stitch(self, monkeypatch):
+        def slow_config(*args):
+            time.sleep(0.5)
+            return 'a.xml'
+        monkeypatch.setattr(stitching, 'create_and_write_stitching_config_from_raw',
+                            slow_config)
+        monkeypatch.setattr(stitching, 'run_stitching_app', lambda *args: None)
+
+    def test_on_stitched_times_only_the_stitching_app(self, tmpdir, fake_stitch):
+        stitched = []
+        path = stitching.stitch_from_raw(str(tmpdir.join('VID_1')), str(tmpdir), 'a.yaml',
+                                         on_stitched=lambda *a: stitched.append(a))
+        assert len(stitched) == 1
+        assert stitched[0][0] == path
+        assert stitched[0][1] < 0.5
+
+    def test_cancelled_while_waiting_for_space(self, tmpdir, fake_stitch, monkeypatch):
+        ran = []
+        monkeypatch.setattr(stitching, 'run_stitching_app', lambda *args: ran.append(args))
+        monkeypatch.setattr(stitching, 'estimate_stitch_footprint', lambda *args: 800)
+        budget = admission.DiskBudget(headroom=100, poll_interval=0.05,
+                                      disk_usage=lambda path: FakeUsage(1100))
+        budget.acquire(str(tmpdir), 800, 'other stitch')
+        cancel_event = threading.Event()
+        threading.Timer(0.2, cancel_event.set).start()
+        stitching.stitch_from_raw(str(tmpdir.join('VID_1')), str(tmpdir), 'a.yaml',
+                                  cancel_event=cancel_event, disk_budget=budget)
+        assert not ran
+
+    def test_on_stitched_not_called_when_cancelled(self, tmpdir, fake_stitch):
+        cancel_event = threading.Event()
+        cancel_event.set()
+        stitched = []
+        stitching.stitch_from_raw(str(tmpdir.join('VID_1')), str(tmpdir), 'a.yaml',
+                                  cancel_event=cancel_event,
+                                  on_stitched=lambda *a: stitched.append(a))
+        assert not stitched
@@ -0,0 +1,51 @@
+"""Tests of contact sheet helpers."""
+
+import imageio
+import numpy as np
+
+from flugelhorn import thumbnails
+
+
+# Tests
+class TestTileFrames:
+
+    def test_tiles_rows_by_lens(self):
+        frames = [np.full((2, 3, 3), n, np.uint8) for n in range(5)]
+        sheet = thumbnails.tile_frames(frames, 2)
+        assert sheet.shape == (6, 6, 3)
+        assert sheet[0, 3, 0] == 1
+        assert sheet[2, 0, 0] == 2
+        assert sheet[4, 0, 0] == 4
+        # Unused tiles are left black
+        assert sheet[4, 3, 0] == 0
+
+
+class TestContactSheets:
+
+    def test_sheet_has_a_row_per_frame_and_a_column_per_lens(self, tmpdir, raw_recording,
+                                                             lens_levels):
+        sheet_path = thumbnails.make_contact_sheet(str(raw_recording), str(tmpdir),
+                                                   num_frames=3, width=32)
+        assert sheet_path == str(tmpdir.join('VID_20180101_000000_000_contact.jpg'))
+        sheet = imageio.imread(sheet_path)
+        # 64x32 lens videos scale to 32x16 thumbnails
+        assert sheet.shape == (3 * 16, 6 * 32, 3)
+        for lens, level in enumerate(lens_levels):
+            tile = sheet[16:32, lens * 32:(lens + 1) * 32]
+            assert abs(int(tile.mean()) - level) < 8
+
+    def test_selected_lenses(self, tmpdir, raw_recording):
+        sheet_path = thumbnails.make_contact_sheet(str(raw_recording), str(tmpdir),
+                                                   lenses=[0, 3], num_frames=2, width=32)
+        assert imageio.imread(sheet_path).shape == (2 * 16, 2 * 32, 3)
+
+    def test_broken_recording_is_none(self, tmpdir, raw_recording):
+        broken = tmpdir.mkdir('VID_20180101_000001_000')
+        for filename in ['origin_{0}.mp4'.format(lens) for lens in range(6)] + ['preview.mp4']:
+            broken.join(filename).write_binary(b'not a video')
+        output_dir = tmpdir.mkdir('sheets')
+        sheet_paths = thumbnails.make_contact_sheets(
+            [str(raw_recording), str(broken)], str(output_dir), num_frames=2, width=32,
+            workers=2)
+        assert sheet_paths[0] == str(output_dir.join('VID_20180101_000000_000_contact.jpg'))
+        assert sheet_paths[1] is None
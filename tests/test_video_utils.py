@@ -0,0 +1,35 @@
+"""Tests of video utilities."""
+
+import pytest
+from flugelhorn import video_utils
+
+
+# Tests
+class TestSampleTimes:
+
+    def test_single_group(self):
+        groups = [{'start': 0, 'end': 100.0}]
+        samples = video_utils.sample_times(groups, 4)
+        assert [t for _, t in samples] == [12.5, 37.5, 62.5, 87.5]
+
+    def test_spans_groups(self):
+        groups = [{'start': 0, 'end': 60.0}, {'start': 0, 'end': 20.0}]
+        samples = video_utils.sample_times(groups, 2)
+        assert samples[0] == (groups[0], 20.0)
+        assert samples[1] == (groups[1], 0.0)
+
+
+class TestExtractKeyframe:
+
+    def test_scaled_frame(self, raw_recording, lens_levels):
+        frame = video_utils.extract_keyframe(str(raw_recording.join('origin_2.mp4')),
+                                             1.2, (16, 8))
+        assert frame.shape == (8, 16, 3)
+        assert frame.dtype == 'uint8'
+        assert abs(int(frame.mean()) - lens_levels[2]) < 8
+
+    def test_broken_video_raises(self, tmpdir, ffmpeg):
+        broken = tmpdir.join('origin_0.mp4')
+        broken.write_binary(b'not a video')
+        with pytest.raises(video_utils.KeyframeError):
+            video_utils.extract_keyframe(str(broken), 0, (16, 8))
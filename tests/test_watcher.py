@@ -0,0 +1,85 @@
+"""Tests of watch folder functions."""
+
+import os
+
+import pytest
+from flugelhorn import watcher
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+# Fixtures
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def make_capture(base, name):
+    path = os.path.join(str(base), name)
+    os.makedirs(path)
+    with open(os.path.join(path, watcher.PROJECT_FILENAME), 'w') as f:
+        f.write('<project/>')
+    return path
+
+
+# Tests
+class TestFolderWatcher:
+
+    def test_reports_capture_once_stable(self, tmpdir, clock):
+        path = make_capture(tmpdir, 'VID_1')
+        folder_watcher = watcher.FolderWatcher([str(tmpdir)], settle_time=10, clock=clock)
+        assert folder_watcher.poll() == []
+        clock.now = 5
+        assert folder_watcher.poll() == []
+        clock.now = 10
+        assert folder_watcher.poll() == [path]
+        clock.now = 20
+        assert folder_watcher.poll() == []
+
+    def test_changing_capture_is_not_reported(self, tmpdir, clock):
+        path = make_capture(tmpdir, 'VID_1')
+        folder_watcher = watcher.FolderWatcher([str(tmpdir)], settle_time=10, clock=clock)
+        folder_watcher.poll()
+        clock.now = 10
+        with open(os.path.join(path, 'origin_0.mp4'), 'wb') as f:
+            f.write(b'\0' * 16)
+        assert folder_watcher.poll() == []
+        clock.now = 20
+        assert folder_watcher.poll() == [path]
+
+    def test_ignores_dirs_without_project(self, tmpdir, clock):
+        os.makedirs(os.path.join(str(tmpdir), 'System Volume Information'))
+        folder_watcher = watcher.FolderWatcher([str(tmpdir)], settle_time=0, clock=clock)
+        folder_watcher.poll()
+        assert folder_watcher.poll() == []
+
+    def test_missing_watch_dir(self, tmpdir, clock):
+        missing = os.path.join(str(tmpdir), 'not_mounted')
+        folder_watcher = watcher.FolderWatcher([missing], settle_time=0, clock=clock)
+        assert folder_watcher.poll() == []
+
+    def test_forgotten_capture_is_retried_with_backoff(self, tmpdir, clock):
+        path = make_capture(tmpdir, 'VID_1')
+        folder_watcher = watcher.FolderWatcher([str(tmpdir)], settle_time=0, retry_delay=10,
+                                               max_retry_delay=15, clock=clock)
+        folder_watcher.poll()
+        assert folder_watcher.poll() == [path]
+        assert folder_watcher.forget(path) == 10
+        clock.now = 5
+        assert folder_watcher.poll() == []
+        clock.now = 10
+        folder_watcher.poll()
+        assert folder_watcher.poll() == [path]
+        # The delay doubles, up to max_retry_delay
+        assert folder_watcher.forget(path) == 15
+        clock.now = 24
+        assert folder_watcher.poll() == []
+        clock.now = 25
+        folder_watcher.poll()
+        assert folder_watcher.poll() == [path]